@@ -1,99 +1,1253 @@
 import os
+import io
 import time
+import random
+import threading
 import requests
 import sys
+import gzip
+import json
+import hashlib
+import atexit
+import signal
+import logging
+import sqlite3
+import argparse
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import partial
+from array import array
+from itertools import accumulate
+from bisect import bisect_left
 from datetime import date, datetime, timedelta
-from flask import Flask, render_template_string, jsonify
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from requests.adapters import HTTPAdapter
+from urllib3 import HTTPResponse
+from urllib3.util.retry import Retry
+from flask import Flask, Response, render_template_string, jsonify, request, stream_with_context
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 app = Flask(__name__)
 
 # ==== Конфіг ====
-ACCOUNT_NAME = "poka-net3"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+ACCOUNT_NAME = os.getenv("ACCOUNT_NAME", "poka-net3")
 POSTER_TOKEN = os.getenv("POSTER_TOKEN")
 CHOICE_TOKEN = os.getenv("CHOICE_TOKEN")
 WEATHER_KEY = os.getenv("WEATHER_KEY", "")
 
-# Категорії POS ID
+# Адреси API; навантажувальний тест підміняє їх локальними заглушками
+POSTER_BASE_URL = os.getenv("POSTER_BASE_URL", "https://{account}.joinposter.com")
+CHOICE_BASE_URL = os.getenv("CHOICE_BASE_URL", "https://open-api.choiceqr.com").rstrip("/")
+WEATHER_BASE_URL = os.getenv("WEATHER_BASE_URL", "https://api.openweathermap.org").rstrip("/")
+
+# Кілька закладів з одного сервісу; без файлу — один заклад з ACCOUNT_NAME та токенів вище
+VENUES_CONFIG = os.getenv("VENUES_CONFIG", "venues.json")
+GROUP_SLUG = "group"
+
+# Фонове оновлення (секунди)
+SALES_REFRESH_SEC = int(os.getenv("SALES_REFRESH_SEC", 60))
+BOOKINGS_REFRESH_SEC = int(os.getenv("BOOKINGS_REFRESH_SEC", 600))
+PRODUCTS_REFRESH_SEC = int(os.getenv("PRODUCTS_REFRESH_SEC", 3600))
+PRODUCTS_DELTA_SEC = int(os.getenv("PRODUCTS_DELTA_SEC", 300))
+TABLES_REFRESH_SEC = int(os.getenv("TABLES_REFRESH_SEC", 30))
+
+# Час життя кешів окремих ендпоінтів (секунди)
+SALES_TTL_SEC = int(os.getenv("SALES_TTL_SEC", 90))
+TABLES_TTL_SEC = int(os.getenv("TABLES_TTL_SEC", 15))
+BOOKINGS_TTL_SEC = int(os.getenv("BOOKINGS_TTL_SEC", 600))
+WEATHER_TTL_SEC = int(os.getenv("WEATHER_TTL_SEC", 600))
+
+# Push-канал для екранів (Server-Sent Events)
+STREAM_HEARTBEAT_SEC = int(os.getenv("STREAM_HEARTBEAT_SEC", 15))
+# Кожен SSE-екран займає потік gthread-воркера на все з'єднання: понад ліміт потік не відкривається (503),
+# і сторінка одразу переходить на опитування, для якого лишаються вільні потоки
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", max(1, int(os.getenv("GUNICORN_THREADS", 16)) // 2)))
+
+# Скільки попередніх версій кожної відповіді пам'ятати для дельт (?since=<etag>)
+DELTA_HISTORY = int(os.getenv("DELTA_HISTORY", 8))
+# Менші відповіді не стискаються
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 512))
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") != "0"
+
+# Паралельні запити до API
+UPSTREAM_WORKERS = int(os.getenv("UPSTREAM_WORKERS", 6))
+SALES_REFRESH_DEADLINE = float(os.getenv("SALES_REFRESH_DEADLINE", 30))
+PAGE_PARALLELISM = int(os.getenv("PAGE_PARALLELISM", 4))
+
+# HTTP-з'єднання: пул на кожен хост, повтори з експоненційною затримкою
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", 10))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", 0.5))
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", 0.3))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+# (з'єднання, читання): хост, що не відповідає, не тримає запит довше за ці секунди
+HTTP_TIMEOUTS = (min(HTTP_CONNECT_TIMEOUT, HTTP_TIMEOUT), HTTP_TIMEOUT)
+
+# Запобіжник на хост: після BREAKER_FAILURES збоїв поспіль запити BREAKER_OPEN_SEC секунд не надсилаються
+BREAKER_FAILURES = int(os.getenv("BREAKER_FAILURES", 5))
+BREAKER_OPEN_SEC = float(os.getenv("BREAKER_OPEN_SEC", 30))
+
+# Ліміти запитів до API (запитів на секунду на хост; 0 — без обмеження) і запас на сплеск у секундах
+POSTER_RATE = float(os.getenv("POSTER_RATE", 5))
+CHOICE_RATE = float(os.getenv("CHOICE_RATE", 2))
+WEATHER_RATE = float(os.getenv("WEATHER_RATE", 1))
+RATE_BURST_SEC = float(os.getenv("RATE_BURST_SEC", 2))
+# Токени й лічильники хоста спільні для всіх процесів з тим самим AGGREGATE_DB (воркери, backfill)
+RATE_SHARED = os.getenv("RATE_SHARED", "1") != "0"
+RATE_WAITER_TTL_SEC = 3
+
+# Потоковий розбір сторінок transactions.getTransactions (потрібен ijson)
+JSON_STREAMING = os.getenv("JSON_STREAMING", "1") != "0"
+
+# Локальний архів агрегатів по закритих днях
+AGGREGATE_DB = os.getenv("AGGREGATE_DB", "aggregates.db")
+
+# Знімок останніх відповідей для миттєвого старту після сну/деплою
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot.json")
+SNAPSHOT_SEC = int(os.getenv("SNAPSHOT_SEC", 60))
+
+# Кілька воркерів (gunicorn): один лідер ходить в API й пише знімки в AGGREGATE_DB, решта їх читає
+SHARED_STORE = os.getenv("SHARED_STORE", "0") == "1"
+SHARED_POLL_SEC = float(os.getenv("SHARED_POLL_SEC", 1))
+LEADER_LOCK = os.getenv("LEADER_LOCK", f"{AGGREGATE_DB}.leader")
+
+# Запис і відтворення відповідей API: live, record (зберігати у FIXTURES_DIR) або replay (віддавати звідти)
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live")
+FIXTURES_DIR = os.getenv("FIXTURES_DIR", "fixtures")
+REPLAY_LATENCY_SEC = float(os.getenv("REPLAY_LATENCY_SEC", 0.05))
+REPLAY_JITTER_SEC = float(os.getenv("REPLAY_JITTER_SEC", 0))
+
+# Межі гістограм /metrics (секунди)
+METRICS_BUCKETS = tuple(float(b) for b in os.getenv("METRICS_BUCKETS", "0.01,0.05,0.1,0.25,0.5,1,2.5,5,10").split(","))
+
+# Сьогоднішні транзакції: довантажуємо лише нові, повний перерахунок раз на FULL_RECONCILE_SEC
+INCREMENTAL_TODAY = os.getenv("INCREMENTAL_TODAY", "1") != "0"
+FULL_RECONCILE_SEC = int(os.getenv("FULL_RECONCILE_SEC", 900))
+
+# Категорії POS ID (за замовчуванням для закладів без власних)
 HOT_CATEGORIES  = {4, 13, 15, 46, 33}
 COLD_CATEGORIES = {7, 8, 11, 16, 18, 19, 29, 32, 36, 44}
 BAR_CATEGORIES  = {9,14,27,28,34,41,42,47,22,24,25,26,39,30}
 
-# Кеш
-PRODUCT_CACHE = {}
-PRODUCT_CACHE_TS = 0
-CACHE = {
-    "hot": {}, "cold": {}, "hot_prev": {}, "cold_prev": {},
+# Розкладка столів та координати для погоди за замовчуванням
+HALL_TABLES = [1,2,3,4,5,6,8]
+TERRACE_TABLES = [7,10,11,12,13]
+WEATHER_LOCATION = (50.395, 30.355)
+
+# Цехи у покажчику товарів
+STATION_OTHER, STATION_HOT, STATION_COLD, STATION_BAR = 0, 1, 2, 3
+
+# Часове вікно графіка та роздільність інтервалів (хвилини)
+def _minute_of_day(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+MINUTES_PER_DAY = 24 * 60
+OPEN_MINUTE = _minute_of_day(os.getenv("OPEN_FROM", "10:00"))
+CLOSE_MINUTE = _minute_of_day(os.getenv("OPEN_TILL", "23:00"))
+SERIES_RESOLUTIONS = sorted({int(r) for r in os.getenv("SERIES_RESOLUTIONS", "5,15,30,60").split(",")})
+DEFAULT_RESOLUTION = int(os.getenv("DEFAULT_RESOLUTION", 60))
+if DEFAULT_RESOLUTION not in SERIES_RESOLUTIONS:
+    SERIES_RESOLUTIONS.append(DEFAULT_RESOLUTION)
+# Помилка в налаштуваннях інакше вилітала б у кожному оновленні продажів, а графіки тихо ставали б degraded
+if not 0 <= OPEN_MINUTE < CLOSE_MINUTE <= MINUTES_PER_DAY:
+    raise ValueError(
+        f"OPEN_FROM must be earlier than OPEN_TILL within one day (00:00-24:00), "
+        f"got {os.getenv('OPEN_FROM', '10:00')}-{os.getenv('OPEN_TILL', '23:00')}; "
+        f"for a venue open past midnight use OPEN_TILL=24:00"
+    )
+if SERIES_RESOLUTIONS[0] <= 0 or DEFAULT_RESOLUTION <= 0:
+    raise ValueError(
+        f"SERIES_RESOLUTIONS and DEFAULT_RESOLUTION must be positive minutes, got "
+        f"{', '.join(map(str, sorted(SERIES_RESOLUTIONS)))}"
+    )
+
+EMPTY_SALES = {
+    "hot": {}, "cold": {}, "bar": {}, "hot_prev": {}, "cold_prev": {},
     "hourly": {}, "hourly_prev": {}, "hourly_year": {}, "share": {}
 }
-CACHE_TS = 0
 
-BOOKINGS_CACHE = []
-BOOKINGS_CACHE_TS = 0
+# Канали ("<заклад>:<розділ>"), підняті зі знімка на диску й ще не оновлені наживо
+STALE = set()
+
+# Канал -> розділи, що віддаються з останнього вдалого оновлення, бо API зараз недоступний
+DEGRADED = {}
+_degraded_lock = threading.Lock()
+
+# ===== Логування =====
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def _setup_logging():
+    handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(threadName)s] %(message)s"))
+    logger = logging.getLogger("dashboard")
+    logger.addHandler(handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    return logger
+
+log = _setup_logging()
+
+def _body_snippet(resp, limit=500):
+    # Лише перші байти тіла, без декодування всієї відповіді
+    return resp.content[:limit].decode(resp.encoding or "utf-8", "replace").replace("\n", " ")
+
+# ===== Метрики (формат Prometheus) =====
+# Лічильники в пам'яті процесу: запис — словник і замок, текст рахується лише під час запиту /metrics
+class Metric:
+    def __init__(self, name, help_text, kind, labels=(), buckets=None):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def observe(self, value, *labels):
+        # Гістограма: лічильники по кошиках (не накопичувальні), сума, кількість
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            state[bisect_left(self.buckets, value)] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _series(self, suffix, labels, value, extra=""):
+        pairs = [_worker_label()] + [f'{name}="{_label_value(v)}"' for name, v in zip(self.labels, labels)]
+        if extra:
+            pairs.append(extra)
+        return f"{self.name}{suffix}{{{','.join(pairs)}}} {value}"
+
+    def render(self):
+        with self.lock:
+            values = {labels: list(v) if isinstance(v, list) else v for labels, v in self.values.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(values.items()):
+            if self.kind != "histogram":
+                lines.append(self._series("", labels, value))
+                continue
+            for bound, count in zip((*self.buckets, "+Inf"), accumulate(value[:-2])):
+                lines.append(self._series("_bucket", labels, count, f'le="{bound}"'))
+            lines.append(self._series("_sum", labels, round(value[-2], 6)))
+            lines.append(self._series("_count", labels, value[-1]))
+        return lines
+
+def _worker_label():
+    # З кількома воркерами кожен процес рахує своє, а scrape потрапляє у випадковий:
+    # без мітки процесу лічильники стрибали б між воркерами й виглядали б як скидання
+    return f'worker="{os.getpid()}"'
+
+def gauge_sample(name, labels, value):
+    pairs = [_worker_label()] + [f'{key}="{_label_value(v)}"' for key, v in labels.items()]
+    return f"{name}{{{','.join(pairs)}}} {value}"
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+METRICS = []
+
+def metric(name, help_text, kind="counter", labels=(), buckets=None):
+    m = Metric(name, help_text, kind, labels, buckets)
+    METRICS.append(m)
+    return m
+
+UPSTREAM_REQUESTS = metric(
+    "dashboard_upstream_requests_total", "Upstream API calls by method and result",
+    labels=("upstream", "method", "status")
+)
+UPSTREAM_SECONDS = metric(
+    "dashboard_upstream_request_seconds", "Upstream API call latency",
+    "histogram", ("upstream", "method"), METRICS_BUCKETS
+)
+UPSTREAM_PAGES = metric(
+    "dashboard_upstream_pages", "Pages fetched per paginated load",
+    "histogram", ("method",), (1, 2, 3, 5, 10, 20, 50)
+)
+CACHE_REQUESTS = metric("dashboard_cache_requests_total", "Cache reads by result", labels=("cache", "result"))
+CACHE_REFRESH_SECONDS = metric(
+    "dashboard_cache_refresh_seconds", "Cache refresh duration",
+    "histogram", ("cache", "result"), METRICS_BUCKETS
+)
+HTTP_SECONDS = metric(
+    "dashboard_http_request_seconds", "Dashboard endpoint handling time",
+    "histogram", ("endpoint", "status"), METRICS_BUCKETS
+)
+HTTP_BYTES = metric(
+    "dashboard_http_response_bytes", "Dashboard response body size (after compression)",
+    "histogram", ("endpoint",), (256, 1024, 4096, 16384, 65536, 262144)
+)
+
+def upstream_method(url):
+    # Метод Poster (transactions.getTransactions) чи останній сегмент шляху інших API
+    return urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1] or "/"
+
+# ===== Заклади =====
+class Venue:
+    def __init__(self, slug, config):
+        self.slug = slug
+        self.title = config.get("title", slug)
+        self.account = config.get("account", slug)
+        self.poster_api = POSTER_BASE_URL.format(account=self.account).rstrip("/") + "/api"
+        # Токени можна не тримати у файлі: POSTER_TOKEN_<SLUG>, CHOICE_TOKEN_<SLUG>
+        env = slug.upper().replace("-", "_")
+        self.poster_token = config.get("poster_token") or os.getenv(f"POSTER_TOKEN_{env}")
+        self.choice_token = config.get("choice_token") or os.getenv(f"CHOICE_TOKEN_{env}")
+        weather = config.get("weather") or {}
+        self.location = (
+            float(weather.get("lat", WEATHER_LOCATION[0])), float(weather.get("lon", WEATHER_LOCATION[1]))
+        )
+        categories = config.get("categories") or {}
+        self.hot_categories = set(categories.get("hot", HOT_CATEGORIES))
+        self.cold_categories = set(categories.get("cold", COLD_CATEGORIES))
+        self.bar_categories = set(categories.get("bar", BAR_CATEGORIES))
+        tables = config.get("tables") or {}
+        self.hall_tables = list(tables.get("hall", HALL_TABLES))
+        self.terrace_tables = list(tables.get("terrace", TERRACE_TABLES))
+
+        # Довідник товарів (product_id -> категорія) і покажчик product_id -> цех (STATION_*)
+        # підміняються одним кортежем: читач не поєднає новий покажчик зі старим довідником
+        self.catalog = ({}, bytearray())
+        self.products_ts = 0
+        self.products_lock = threading.Lock()
+        # id товарів, яких ще немає в довіднику (добираються поштучно), і тих, яких немає і в Poster
+        self.missing_products = set()
+        self.unknown_products = set()
+        self.missing_lock = threading.Lock()
+
+        # Інкрементальний облік сьогоднішнього дня
+        self.today = {
+            "day": None, "hot": None, "cold": None, "count": 0,
+            "watermark": "", "boundary": set(), "reconciled": 0
+        }
+        self.today_lock = threading.Lock()
+
+    @property
+    def products(self):
+        return self.catalog[0]
+
+    @property
+    def stations(self):
+        return self.catalog[1]
+
+    def channel(self, kind):
+        return f"{self.slug}:{kind}"
+
+def load_venues():
+    try:
+        with open(VENUES_CONFIG, encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {ACCOUNT_NAME: {"poster_token": POSTER_TOKEN, "choice_token": CHOICE_TOKEN}}
+    if GROUP_SLUG in config:
+        raise ValueError(f"venue name '{GROUP_SLUG}' is reserved for the group view")
+    return {slug: Venue(slug, venue) for slug, venue in config.items()}
+
+# Перший заклад обслуговує адреси без префікса (/api/sales)
+VENUES = load_venues()
+DEFAULT_VENUE = next(iter(VENUES.values()))
+
+# ===== Ліміти запитів =====
+# Живі дані для екранів мають перевагу над довідником і backfill
+PRIORITY_LIVE, PRIORITY_CATALOG, PRIORITY_BACKFILL = 0, 1, 2
+PRIORITY_NAMES = ("live", "catalog", "backfill")
+REQUEST_PRIORITY = contextvars.ContextVar("request_priority", default=PRIORITY_LIVE)
+
+@contextmanager
+def request_priority(priority):
+    token = REQUEST_PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        REQUEST_PRIORITY.reset(token)
+
+def submit(pool, fn, *args):
+    # Завдання в пулі успадковує пріоритет потоку, що його ставить
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+def _upstream_of(host):
+    if host.endswith("joinposter.com") or host == urlsplit(POSTER_BASE_URL).netloc:
+        return "poster", POSTER_RATE
+    if host.endswith("choiceqr.com") or host == urlsplit(CHOICE_BASE_URL).netloc:
+        return "choice", CHOICE_RATE
+    if host.endswith("openweathermap.org") or host == urlsplit(WEATHER_BASE_URL).netloc:
+        return "weather", WEATHER_RATE
+    return "other", 0
+
+class TokenBucket:
+    def __init__(self, host):
+        self.host = host
+        self.upstream, self.rate = _upstream_of(host)
+        self.burst = max(1.0, self.rate * RATE_BURST_SEC)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.cond = threading.Condition()
+        self.waiting = [0] * len(PRIORITY_NAMES)
+        # Використання за поточну й попередню хвилину, по пріоритетах
+        self.minute = int(time.time() // 60)
+        self.used = [0] * len(PRIORITY_NAMES)
+        self.used_prev = [0] * len(PRIORITY_NAMES)
+        self.waited = [0.0] * len(PRIORITY_NAMES)
+        self.shared = RATE_SHARED and self.rate > 0
+        self._conn = None
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _rollover(self):
+        minute = int(time.time() // 60)
+        if minute != self.minute:
+            self.used_prev = self.used if minute == self.minute + 1 else [0] * len(PRIORITY_NAMES)
+            self.used = [0] * len(PRIORITY_NAMES)
+            self.minute = minute
+
+    def _count(self, priority, waited):
+        self._rollover()
+        self.used[priority] += 1
+        self.waited[priority] += waited
+
+    def acquire(self, priority=PRIORITY_LIVE):
+        started = time.monotonic()
+        with self.cond:
+            if self.rate <= 0:
+                self._count(priority, 0.0)
+                return
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    # Запит чекає, доки є токен і не чекає ніхто важливіший
+                    if not any(self.waiting[:priority]):
+                        if self.shared:
+                            try:
+                                granted, tokens = self._take_shared(priority, time.monotonic() - started)
+                            except sqlite3.Error as e:
+                                log.warning("%s shared rate limit unavailable: %s", self.host, e)
+                                self.shared = False
+                                continue
+                            if granted:
+                                break
+                            # Токен є, але його чекає важливіший запит іншого процесу
+                            delay = 0.1 if tokens >= 1 else (1 - tokens) / self.rate
+                            self.cond.wait(min(0.25, max(0.01, delay)))
+                            continue
+                        if self.tokens >= 1:
+                            self.tokens -= 1
+                            break
+                    self.cond.wait(max(0.01, (1 - self.tokens) / self.rate))
+            finally:
+                self.waiting[priority] -= 1
+                self.cond.notify_all()
+            self._count(priority, time.monotonic() - started)
+
+    def _take_shared(self, priority, waited):
+        # Одна транзакція: поповнення спільного відра, перевірка важливіших запитів в інших процесах,
+        # списання токена, пульс власного найважливішого очікування й лічильник використання
+        if self._conn is None:
+            _store_connect().close()
+            # З'єднання відра використовують різні потоки, але завжди під self.cond
+            self._conn = sqlite3.connect(AGGREGATE_DB, timeout=10, check_same_thread=False, isolation_level=None)
+        conn, now, pid = self._conn, time.time(), os.getpid()
+        minute = int(now // 60)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE host = ?", (self.host,)).fetchone()
+            tokens = self.burst if row is None else min(self.burst, row[0] + max(0.0, now - row[1]) * self.rate)
+            blocked = conn.execute(
+                "SELECT 1 FROM rate_waiters WHERE host = ? AND pid != ? AND priority < ? AND updated > ?",
+                (self.host, pid, priority, now - RATE_WAITER_TTL_SEC),
+            ).fetchone()
+            granted = tokens >= 1 and blocked is None
+            if granted:
+                tokens -= 1
+                conn.execute(
+                    "INSERT INTO rate_usage (host, minute, priority, used, waited) VALUES (?, ?, ?, 1, ?)"
+                    " ON CONFLICT (host, minute, priority) DO UPDATE SET used = used + 1, waited = waited + ?",
+                    (self.host, minute, priority, waited, waited),
+                )
+                if minute != self.minute:
+                    conn.execute("DELETE FROM rate_usage WHERE host = ? AND minute < ?", (self.host, minute - 1))
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (host, tokens, updated) VALUES (?, ?, ?)",
+                (self.host, tokens, now),
+            )
+            waiting = list(self.waiting)
+            if granted:
+                waiting[priority] -= 1
+            top = next((p for p, n in enumerate(waiting) if n > 0), None)
+            if top is None:
+                conn.execute("DELETE FROM rate_waiters WHERE host = ? AND pid = ?", (self.host, pid))
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_waiters (host, pid, priority, updated) VALUES (?, ?, ?, ?)",
+                    (self.host, pid, top, now),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return granted, tokens
+
+    def _shared_usage(self):
+        minute = int(time.time() // 60)
+        conn = _store_connect()
+        try:
+            rows = conn.execute(
+                "SELECT minute, priority, used, waited FROM rate_usage WHERE host = ? AND minute >= ?",
+                (self.host, minute - 1),
+            ).fetchall()
+            bucket = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE host = ?", (self.host,)).fetchone()
+            waiters = conn.execute(
+                "SELECT priority, COUNT(*) FROM rate_waiters WHERE host = ? AND updated > ? GROUP BY priority",
+                (self.host, time.time() - RATE_WAITER_TTL_SEC),
+            ).fetchall()
+        finally:
+            conn.close()
+        used, used_prev, waited = ([0] * len(PRIORITY_NAMES) for _ in range(3))
+        for row_minute, priority, count, seconds in rows:
+            (used if row_minute == minute else used_prev)[priority] = count
+            if row_minute == minute:
+                waited[priority] = seconds
+        tokens = self.burst if bucket is None else min(
+            self.burst, bucket[0] + max(0.0, time.time() - bucket[1]) * self.rate
+        )
+        return {
+            "tokens": round(tokens, 2),
+            "this_minute": dict(zip(PRIORITY_NAMES, used)),
+            "last_minute": dict(zip(PRIORITY_NAMES, used_prev)),
+            "waited_sec": {name: round(w, 2) for name, w in zip(PRIORITY_NAMES, waited)},
+            "processes_waiting": {PRIORITY_NAMES[p]: n for p, n in waiters},
+        }
+
+    def usage(self):
+        if self.shared:
+            # Використання всіх процесів (воркери й backfill) з AGGREGATE_DB, без місцевих лічильників
+            try:
+                shared = self._shared_usage()
+            except sqlite3.Error as e:
+                log.warning("%s shared rate usage: %s", self.host, e)
+            else:
+                return {"upstream": self.upstream, "rate": self.rate, "burst": self.burst, "shared": True, **shared}
+        with self.cond:
+            self._refill(time.monotonic())
+            self._rollover()
+            return {
+                "upstream": self.upstream,
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(self.tokens, 2),
+                "this_minute": dict(zip(PRIORITY_NAMES, self.used)),
+                "last_minute": dict(zip(PRIORITY_NAMES, self.used_prev)),
+                "waiting": dict(zip(PRIORITY_NAMES, self.waiting)),
+                "waited_sec": {name: round(w, 2) for name, w in zip(PRIORITY_NAMES, self.waited)},
+            }
+
+# ===== Запобіжники (circuit breaker) =====
+class UpstreamUnavailable(requests.ConnectionError):
+    pass
+
+class UpstreamError(Exception):
+    # API відповів 200, але з помилкою в тілі
+    pass
+
+class CircuitBreaker:
+    def __init__(self, host):
+        self.host = host
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0
+        # Час початку пробного запиту в стані half-open (0 — немає)
+        self.trial = 0
+        self.lock = threading.Lock()
+
+    def before(self):
+        # Поки запобіжник розімкнено, запит падає одразу, без очікування таймауту
+        with self.lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < BREAKER_OPEN_SEC:
+                    raise UpstreamUnavailable(f"{self.host}: circuit open")
+                self.state = "half-open"
+            if self.state == "half-open":
+                # Пробний запит, результат якого так і не надійшов, не блокує хост назавжди
+                if self.trial and time.time() - self.trial < BREAKER_OPEN_SEC:
+                    raise UpstreamUnavailable(f"{self.host}: circuit half-open")
+                self.trial = time.time()
+
+    def success(self):
+        with self.lock:
+            changed = self.state != "closed"
+            if changed:
+                log.info("%s: circuit closed", self.host)
+            self.state, self.failures, self.trial = "closed", 0, 0
+        if changed:
+            share_health()
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = 0
+            changed = self.state == "half-open" or (self.state == "closed" and self.failures >= BREAKER_FAILURES)
+            if changed:
+                log.warning("%s: circuit open after %d failures", self.host, self.failures)
+                self.state, self.opened_at = "open", time.time()
+        if changed:
+            share_health()
+
+    def status(self):
+        with self.lock:
+            return {"state": self.state, "failures": self.failures, "opened_at": self.opened_at or None}
+
+class RateLimitedAdapter(HTTPAdapter):
+    def __init__(self, bucket, breaker, **kwargs):
+        self.bucket = bucket
+        self.breaker = breaker
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        upstream, method = self.bucket.upstream, upstream_method(request.url)
+        try:
+            self.breaker.before()
+        except UpstreamUnavailable:
+            UPSTREAM_REQUESTS.inc(upstream, method, "circuit_open")
+            raise
+        self.bucket.acquire(REQUEST_PRIORITY.get())
+        started = time.perf_counter()
+        try:
+            resp = self._send(request, **kwargs)
+        except Exception:
+            UPSTREAM_REQUESTS.inc(upstream, method, "error")
+            self.breaker.failure()
+            raise
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, upstream, method)
+        UPSTREAM_REQUESTS.inc(upstream, method, str(resp.status_code))
+        if resp.status_code == 429 or resp.status_code >= 500:
+            self.breaker.failure()
+        elif resp.status_code >= 400 or self.bucket.upstream != "poster":
+            self.breaker.success()
+        # Poster повідомляє про ліміт і помилки в тілі з кодом 200 — результат фіксує розбір тіла
+        return resp
+
+    def _send(self, request, **kwargs):
+        return super().send(request, **kwargs)
+
+# ===== Запис і відтворення відповідей API =====
+# Токени й ключі не потрапляють ні в ключ фікстури, ні у файл
+SECRET_PARAMS = {"token", "appid"}
+
+def fixture_key(url):
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query) if k not in SECRET_PARAMS)
+    return f"{parts.netloc}{parts.path}?{urlencode(query)}"
+
+class FixtureStore:
+    # Одна відповідь — один файл <host>/<метод>-<хеш ключа>.json
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, url):
+        key = fixture_key(url)
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.root, urlsplit(url).netloc, f"{upstream_method(url)}-{digest}.json")
+
+    def load(self, url):
+        try:
+            with open(self.path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, url, status, content_type, body):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fixture = {
+            "url": fixture_key(url), "status": status, "content_type": content_type,
+            "body": body.decode("utf-8", "replace"),
+        }
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(fixture, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+FIXTURES = FixtureStore(FIXTURES_DIR)
+# url -> фікстура або None; бенчмарк підставляє сюди синтетичні набори даних
+REPLAY_SOURCE = FIXTURES.load
+
+def _fixture_response(adapter, request, status, content_type, body):
+    # Відповідь збирається так само, як із мережі, тож потоковий розбір (ijson) працює без змін
+    raw = HTTPResponse(
+        body=io.BytesIO(body), headers={"Content-Type": content_type or "application/json"},
+        status=status, preload_content=False, decode_content=False, request_method=request.method,
+    )
+    return adapter.build_response(request, raw)
+
+class RecordingAdapter(RateLimitedAdapter):
+    def _send(self, request, **kwargs):
+        resp = super()._send(request, **kwargs)
+        body = resp.content
+        content_type = resp.headers.get("Content-Type")
+        FIXTURES.save(request.url, resp.status_code, content_type, body)
+        return _fixture_response(self, request, resp.status_code, content_type, body)
+
+class ReplayAdapter(RateLimitedAdapter):
+    def _send(self, request, **kwargs):
+        fixture = REPLAY_SOURCE(request.url)
+        delay = REPLAY_LATENCY_SEC + (random.uniform(0, REPLAY_JITTER_SEC) if REPLAY_JITTER_SEC else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if fixture is None:
+            raise requests.ConnectionError(f"no fixture for {fixture_key(request.url)}")
+        body = fixture["body"].encode("utf-8")
+        return _fixture_response(self, request, fixture["status"], fixture.get("content_type"), body)
+
+UPSTREAM_ADAPTERS = {"live": RateLimitedAdapter, "record": RecordingAdapter, "replay": ReplayAdapter}
+if UPSTREAM_MODE not in UPSTREAM_ADAPTERS:
+    raise ValueError(f"UPSTREAM_MODE must be one of: {', '.join(UPSTREAM_ADAPTERS)}")
+
+# ===== HTTP-сесії =====
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+# host -> TokenBucket, CircuitBreaker
+LIMITERS = {}
+BREAKERS = {}
+
+def _make_session(host):
+    # Таймаут читання не повторюється: завислий хост одразу дає збій запобіжнику,
+    # а не (HTTP_RETRIES + 1) × HTTP_TIMEOUT очікування
+    retry = Retry(
+        total=HTTP_RETRIES,
+        read=0,
+        backoff_factor=HTTP_BACKOFF,
+        backoff_jitter=HTTP_BACKOFF_JITTER,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"GET"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    bucket = LIMITERS[host] = TokenBucket(host)
+    breaker = BREAKERS[host] = CircuitBreaker(host)
+    adapter = UPSTREAM_ADAPTERS[UPSTREAM_MODE](
+        bucket, breaker, pool_connections=1, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def http_session(url):
+    # Одна сесія (і один keep-alive пул) на хост, спільна для всіх потоків
+    host = urlsplit(url).netloc
+    session = _SESSIONS.get(host)
+    if session is None:
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(host)
+            if session is None:
+                session = _SESSIONS[host] = _make_session(host)
+    return session
 
 # ===== Helpers =====
-def _get(url, **kwargs):
-    r = requests.get(url, timeout=kwargs.pop("timeout", 25))
-    log_snippet = r.text[:500].replace("\n", " ")
-    print(f"DEBUG GET {url.split('?')[0]} -> {r.status_code} : {log_snippet}", file=sys.stderr, flush=True)
-    r.raise_for_status()
+def _get(url, stream=False, **kwargs):
+    r = http_session(url).get(url, timeout=kwargs.pop("timeout", HTTP_TIMEOUTS), stream=stream)
+    if log.isEnabledFor(logging.DEBUG):
+        snippet = "(streamed)" if stream else _body_snippet(r)
+        log.debug("GET %s -> %s : %s", url.split("?")[0], r.status_code, snippet)
+    try:
+        r.raise_for_status()
+    except Exception:
+        r.close()
+        raise
     return r
 
-# ===== Довідник товарів =====
-def load_products():
-    global PRODUCT_CACHE, PRODUCT_CACHE_TS
-    if PRODUCT_CACHE and time.time() - PRODUCT_CACHE_TS < 3600:
-        return PRODUCT_CACHE
+def poster_checked(resp, failed):
+    # Запобіжник хоста Poster дізнається про результат лише після розбору тіла
+    breaker = BREAKERS.get(urlsplit(resp.url).netloc)
+    if breaker is not None:
+        if failed:
+            breaker.failure()
+        else:
+            breaker.success()
+
+def _poster_body(resp):
+    # Poster повідомляє про помилки (ліміт, токен) у тілі відповіді з кодом 200
+    try:
+        body = resp.json()
+    except ValueError:
+        poster_checked(resp, failed=True)
+        raise
+    failed = isinstance(body, dict) and "error" in body
+    poster_checked(resp, failed)
+    if failed:
+        raise UpstreamError(f"{urlsplit(resp.url).path}: {body['error']}")
+    return body
+
+# ===== Паралельні запити =====
+UPSTREAM_POOL = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix="upstream")
+
+def fan_out(calls):
+    return {name: submit(UPSTREAM_POOL, fn, *args) for name, (fn, *args) in calls.items()}
+
+def gather(futures, deadline):
+    done, _ = wait(futures.values(), timeout=deadline)
+    results = {}
+    for name, fut in futures.items():
+        if fut not in done:
+            log.warning("%s: not ready after %ss, keeping previous value", name, deadline)
+        elif fut.exception() is not None:
+            log.error("%s: %s", name, fut.exception())
+        else:
+            results[name] = fut.result()
+    return results
+
+# ===== Кеш з TTL та об'єднанням запитів =====
+class TTLCache:
+    # Значення й час оновлення підміняються одним кортежем у копії словника,
+    # тож читач ніколи не бачить напівоновлений запис чи значення від іншого оновлення.
+    # Одночасні виклики під час оновлення ключа чекають на той самий запит (single-flight)
+    def __init__(self, name, loader, ttl, default=None):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.default = default
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._write = threading.Lock()
+        # Викликаються з (cache, key, value, ts) після кожного запису
+        self.listeners = []
+
+    def entry(self, key=None):
+        return self._entries.get(key, (self.default, 0))
+
+    def age(self, key=None):
+        ts = self.entry(key)[1]
+        return time.time() - ts if ts else None
+
+    def fresh(self, key=None):
+        age = self.age(key)
+        return age is not None and age < self.ttl
+
+    def refreshing(self, key=None):
+        return key in self._flights
+
+    def meta(self, key=None):
+        age = self.age(key)
+        return {
+            "ts": self.entry(key)[1] or None,
+            "age": round(age, 1) if age is not None else None,
+            "ttl": self.ttl,
+            "fresh": age is not None and age < self.ttl,
+            "refreshing": self.refreshing(key),
+        }
+
+    def get(self, key=None):
+        if self.fresh(key):
+            CACHE_REQUESTS.inc(self.name, "hit")
+            return self.entry(key)[0]
+        CACHE_REQUESTS.inc(self.name, "miss")
+        return self.refresh(key)
+
+    def refresh(self, key=None):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Future()
+        if not leader:
+            return flight.result()
+
+        started = time.perf_counter()
+        try:
+            # Завантажувач, що сам пише в кеш через update(), повертає None
+            value = self.loader() if key is None else self.loader(key)
+            if value is not None:
+                self.put(value, key=key)
+            value = self.entry(key)[0]
+        except BaseException as e:
+            CACHE_REFRESH_SECONDS.observe(time.perf_counter() - started, self.name, "error")
+            flight.set_exception(e)
+            raise
+        else:
+            CACHE_REFRESH_SECONDS.observe(time.perf_counter() - started, self.name, "ok")
+            flight.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def refresh_in_background(self, key=None):
+        if not self.refreshing(key):
+            threading.Thread(
+                target=self._refresh_quietly, args=(key,), name=f"refresh-{self.name}", daemon=True
+            ).start()
+
+    def _refresh_quietly(self, key):
+        try:
+            self.refresh(key)
+        except Exception as e:
+            log.error("%s refresh: %s", self.name, e)
+
+    def put(self, value, ts=None, key=None):
+        with self._write:
+            self._store(key, value, time.time() if ts is None else ts)
+
+    def update(self, fn, touch=True, key=None):
+        # fn(старе значення) -> нове; виконується під замком запису, тож оновлення не губляться
+        with self._write:
+            old, ts = self._entries.get(key, (self.default, 0))
+            value = fn(old)
+            self._store(key, value, time.time() if touch else ts)
+            return value
+
+    def _store(self, key, value, ts):
+        self._entries = {**self._entries, key: (value, ts)}
+        for listener in self.listeners:
+            listener(self, key, value, ts)
+
+# ===== Посторінкове завантаження =====
+def fetch_pages(page_url, parse_page, per_page, parallelism=None, first_page=1, stream=False):
+    parallelism = max(1, parallelism or PAGE_PARALLELISM)
+    method = upstream_method(page_url(first_page))
+    items, total, page_size = parse_page(_get(page_url(first_page), stream=stream))
+    if not items:
+        UPSTREAM_PAGES.observe(1, method)
+        return [], total
+    page_size = page_size or per_page
+    pages = [items]
+
+    def fetch(page):
+        return parse_page(_get(page_url(page), stream=stream))[0]
+
+    with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="pages") as pool:
+        if total is not None:
+            # Кількість відома з першої сторінки — решту сторінок плануємо одразу
+            last_page = -(-total // page_size)
+            futures = [submit(pool, fetch, page) for page in range(first_page + 1, last_page + 1)]
+            pages.extend(fut.result() for fut in futures)
+        else:
+            # Кількість невідома — вантажимо хвилями до першої неповної сторінки
+            page = first_page + 1
+            while len(pages[-1]) >= page_size:
+                futures = [submit(pool, fetch, p) for p in range(page, page + parallelism)]
+                for data in (fut.result() for fut in futures):
+                    pages.append(data)
+                    if len(data) < page_size:
+                        break
+                page += parallelism
+
+    UPSTREAM_PAGES.observe(len(pages), method)
+    return [item for data in pages for item in data], total
+
+# ===== Архів закритих днів =====
+_store_ready = False
+_store_lock = threading.Lock()
+
+def _store_connect():
+    global _store_ready
+    conn = sqlite3.connect(AGGREGATE_DB, timeout=10)
+    if not _store_ready:
+        with _store_lock:
+            # WAL: читачі з інших воркерів не блокують запис лідера
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS aggregates ("
+                " account TEXT NOT NULL, day TEXT NOT NULL, kind TEXT NOT NULL,"
+                " payload TEXT NOT NULL, created REAL NOT NULL,"
+                " PRIMARY KEY (account, day, kind))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS catalog ("
+                " account TEXT PRIMARY KEY, payload TEXT NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared ("
+                " account TEXT NOT NULL, channel TEXT NOT NULL, ts REAL NOT NULL,"
+                " written REAL NOT NULL, payload TEXT NOT NULL,"
+                " PRIMARY KEY (account, channel))"
+            )
+            # Спільні ліміти запитів: токени хоста, процеси з очікуваннями, використання по хвилинах
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets (host TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_waiters ("
+                " host TEXT NOT NULL, pid INTEGER NOT NULL, priority INTEGER NOT NULL, updated REAL NOT NULL,"
+                " PRIMARY KEY (host, pid))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_usage ("
+                " host TEXT NOT NULL, minute INTEGER NOT NULL, priority INTEGER NOT NULL,"
+                " used INTEGER NOT NULL, waited REAL NOT NULL,"
+                " PRIMARY KEY (host, minute, priority))"
+            )
+            conn.commit()
+            _store_ready = True
+    return conn
+
+def store_get(account, kind, day):
+    conn = _store_connect()
+    try:
+        row = conn.execute(
+            "SELECT payload FROM aggregates WHERE account = ? AND day = ? AND kind = ?",
+            (account, day, kind),
+        ).fetchone()
+    finally:
+        conn.close()
+    return json.loads(row[0]) if row else None
+
+def store_put(account, kind, day, payload):
+    conn = _store_connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO aggregates (account, day, kind, payload, created) VALUES (?, ?, ?, ?, ?)",
+                (account, day, kind, json.dumps(payload, ensure_ascii=False), time.time()),
+            )
+    finally:
+        conn.close()
+
+def store_range(account, kind, day_from, day_to):
+    conn = _store_connect()
+    try:
+        rows = conn.execute(
+            "SELECT day, payload FROM aggregates WHERE account = ? AND kind = ? AND day BETWEEN ? AND ?"
+            " ORDER BY day",
+            (account, kind, day_from, day_to),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(day, json.loads(payload)) for day, payload in rows]
+
+def catalog_load(account):
+    conn = _store_connect()
+    try:
+        row = conn.execute(
+            "SELECT payload, updated FROM catalog WHERE account = ?", (account,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if not row:
+        return None, 0
+    return {int(pid): cid for pid, cid in json.loads(row[0]).items()}, row[1]
+
+def catalog_save(account, mapping, updated):
+    conn = _store_connect()
+    try:
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO catalog (account, payload, updated) VALUES (?, ?, ?)",
+                (account, json.dumps(mapping), updated),
+            )
+    finally:
+        conn.close()
 
+def _complete(result):
+    # compute позначає день "partial", якщо частину даних ще не вдалося врахувати
+    return result, not result.pop("partial", False)
+
+def closed_day_aggregate(venue, kind, day, compute):
+    # Сьогоднішній день ще змінюється — рахуємо завжди наживо
+    if day >= date.today().strftime("%Y-%m-%d"):
+        return _complete(compute(venue, day))[0]
+    try:
+        stored = store_get(venue.account, kind, day)
+    except sqlite3.Error as e:
+        log.error("store read %s %s %s: %s", venue.slug, kind, day, e)
+        return _complete(compute(venue, day))[0]
+    if stored is not None:
+        return stored
+
+    result, complete = _complete(compute(venue, day))
+    if not complete:
+        return result
+    try:
+        store_put(venue.account, kind, day, result)
+    except sqlite3.Error as e:
+        log.error("store write %s %s %s: %s", venue.slug, kind, day, e)
+    return result
+
+# ===== Довідник товарів =====
+def _products_page(resp):
+    data = _poster_body(resp).get("response", [])
+    return (data if isinstance(data, list) else []), None, None
+
+def _station_of(venue, cid):
+    if cid in venue.hot_categories:
+        return STATION_HOT
+    if cid in venue.cold_categories:
+        return STATION_COLD
+    if cid in venue.bar_categories:
+        return STATION_BAR
+    return STATION_OTHER
+
+def compile_stations(venue, mapping):
+    stations = bytearray(max(mapping, default=0) + 1)
+    for pid, cid in mapping.items():
+        stations[pid] = _station_of(venue, cid)
+    return stations
+
+def _set_catalog(venue, mapping, updated):
+    # Покажчик збирається повністю до підміни, тож читачі бачать або стару, або нову пару
+    venue.catalog = (mapping, compile_stations(venue, mapping))
+    venue.products_ts = updated
+
+def _fetch_catalog(venue):
     mapping = {}
     per_page = 500
     for ptype in ("products", "batchtickets"):
-        page = 1
-        while True:
-            url = (
-                f"https://{ACCOUNT_NAME}.joinposter.com/api/menu.getProducts"
-                f"?token={POSTER_TOKEN}&type={ptype}&per_page={per_page}&page={page}"
+        def page_url(page):
+            return (
+                f"{venue.poster_api}/menu.getProducts"
+                f"?token={venue.poster_token}&type={ptype}&per_page={per_page}&page={page}"
             )
+        # Помилка будь-якої сторінки перериває оновлення: неповний довідник не зберігаємо
+        data, _ = fetch_pages(page_url, _products_page, per_page)
+
+        for item in data:
             try:
-                resp = _get(url)
-                data = resp.json().get("response", [])
-            except Exception as e:
-                print("ERROR load_products:", e, file=sys.stderr, flush=True)
-                break
+                pid = int(item.get("product_id", 0))
+                cid = int(item.get("menu_category_id", 0))
+                if pid and cid:
+                    mapping[pid] = cid
+            except Exception:
+                continue
 
-            if not isinstance(data, list) or not data:
-                break
+    if not mapping:
+        raise RuntimeError("menu.getProducts returned no products")
+    return mapping
 
-            for item in data:
+def _fetch_product_category(venue, pid):
+    url = (
+        f"{venue.poster_api}/menu.getProduct"
+        f"?token={venue.poster_token}&product_id={pid}"
+    )
+    item = _poster_body(_get(url)).get("response") or {}
+    if not isinstance(item, dict):
+        return 0
+    return int(item.get("menu_category_id", 0) or 0)
+
+def note_missing_products(venue, pids):
+    with venue.missing_lock:
+        venue.missing_products.update(pids)
+        venue.missing_products.difference_update(venue.unknown_products)
+
+def refresh_products(venue, full=False):
+    with venue.products_lock, request_priority(PRIORITY_CATALOG):
+        now = time.time()
+        if full or not venue.products or now - venue.products_ts >= PRODUCTS_REFRESH_SEC:
+            mapping = _fetch_catalog(venue)
+            updated = now
+            with venue.missing_lock:
+                venue.missing_products.clear()
+                venue.unknown_products.clear()
+        else:
+            # Poster не віддає змінені з певного часу товари, тож між повними оновленнями
+            # добираємо поштучно лише ті id, що трапились у транзакціях, але відсутні в довіднику
+            with venue.missing_lock:
+                missing = sorted(venue.missing_products - venue.products.keys())[:50]
+            if not missing:
+                return venue.products
+            found, checked = {}, []
+            for pid in missing:
                 try:
-                    pid = int(item.get("product_id", 0))
-                    cid = int(item.get("menu_category_id", 0))
-                    if pid and cid:
-                        mapping[pid] = cid
-                except Exception:
+                    cid = _fetch_product_category(venue, pid)
+                except Exception as e:
+                    log.warning("%s menu.getProduct %s: %s", venue.slug, pid, e)
                     continue
+                checked.append(pid)
+                if cid:
+                    found[pid] = cid
+            with venue.missing_lock:
+                venue.missing_products.difference_update(checked)
+                venue.unknown_products.update(pid for pid in checked if pid not in found)
+            if not found:
+                return venue.products
+            mapping = dict(venue.products)
+            mapping.update(found)
+            updated = venue.products_ts
+
+        _set_catalog(venue, mapping, updated)
+        log.info("%s products cached: %d items", venue.slug, len(mapping))
+        try:
+            catalog_save(venue.account, mapping, updated)
+        except sqlite3.Error as e:
+            log.error("%s catalog save: %s", venue.slug, e)
+        return venue.products
+
+def load_products(venue):
+    # Довідник оновлюється у фоні; синхронно вантажимо лише коли його ще зовсім немає
+    if not venue.products:
+        try:
+            refresh_products(venue)
+        except Exception as e:
+            log.error("%s load_products: %s", venue.slug, e)
+    return venue.products
 
-            if len(data) < per_page:
-                break
-            page += 1
-
-    PRODUCT_CACHE = mapping
-    PRODUCT_CACHE_TS = time.time()
-    print(f"DEBUG products cached: {len(PRODUCT_CACHE)} items", file=sys.stderr, flush=True)
-    return PRODUCT_CACHE
+def _load_persisted_catalog(venue):
+    try:
+        mapping, updated = catalog_load(venue.account)
+    except sqlite3.Error as e:
+        log.error("%s catalog load: %s", venue.slug, e)
+        return
+    if mapping:
+        _set_catalog(venue, mapping, updated)
+        log.info("%s products loaded from disk: %d items", venue.slug, len(mapping))
 
 # ===== Зведені продажі =====
-def fetch_category_sales(day_offset=0):
+def fetch_category_sales(venue, day_offset=0):
+    # Помилка не підміняється нулями: оновлення залишить попередні цифри
     target_date = (date.today() - timedelta(days=day_offset)).strftime("%Y-%m-%d")
+    return closed_day_aggregate(venue, "categories", target_date, _category_sales_for_date)
+
+def _category_sales_for_date(venue, target_date):
     url = (
-        f"https://{ACCOUNT_NAME}.joinposter.com/api/dash.getCategoriesSales"
-        f"?token={POSTER_TOKEN}&dateFrom={target_date}&dateTo={target_date}"
+        f"{venue.poster_api}/dash.getCategoriesSales"
+        f"?token={venue.poster_token}&dateFrom={target_date}&dateTo={target_date}"
     )
-    try:
-        resp = _get(url)
-        rows = resp.json().get("response", [])
-    except Exception as e:
-        print("ERROR categories:", e, file=sys.stderr, flush=True)
-        return {"hot": {}, "cold": {}, "bar": {}}
+    resp = _get(url)
+    rows = _poster_body(resp).get("response", [])
 
     hot, cold, bar = {}, {}, {}
     for row in rows:
@@ -104,11 +1258,11 @@ def fetch_category_sales(day_offset=0):
         except Exception:
             continue
 
-        if cid in HOT_CATEGORIES:
+        if cid in venue.hot_categories:
             hot[name] = hot.get(name, 0) + qty
-        elif cid in COLD_CATEGORIES:
+        elif cid in venue.cold_categories:
             cold[name] = cold.get(name, 0) + qty
-        elif cid in BAR_CATEGORIES:
+        elif cid in venue.bar_categories:
             bar[name] = bar.get(name, 0) + qty
 
     hot = dict(sorted(hot.items(), key=lambda x: x[0]))
@@ -117,125 +1271,300 @@ def fetch_category_sales(day_offset=0):
     return {"hot": hot, "cold": cold, "bar": bar}
 
 # ===== Функція для отримання даних по конкретній даті =====
-def fetch_transactions_hourly_for_date(target_date_str):
-    products = load_products()
-    
-    per_page = 500
-    page = 1
-    hours = list(range(10, 23))
-    hot_by_hour = [0] * len(hours)
-    cold_by_hour = [0] * len(hours)
+def _transactions_page(resp):
+    body = _poster_body(resp).get("response", {}) or {}
+    page_info = body.get("page", {}) or {}
+    items = body.get("data", []) or []
+    return items, int(body.get("count", 0)), int(page_info.get("per_page", 0) or 0)
+
+_TRX_FIELDS = {
+    "response.data.item.transaction_id": "transaction_id",
+    "response.data.item.date_close": "date_close",
+}
+_LINE_FIELDS = {
+    "response.data.item.products.item.product_id": "product_id",
+    "response.data.item.products.item.num": "num",
+}
 
-    while True:
-        url = (
-            f"https://{ACCOUNT_NAME}.joinposter.com/api/transactions.getTransactions"
-            f"?token={POSTER_TOKEN}&date_from={target_date_str}&date_to={target_date_str}"
+def _stream_transactions_page(resp):
+    # Розбираємо сторінку подіями ijson і залишаємо лише поля, які потрібні агрегатору
+    count, per_page, items = 0, 0, []
+    trx = line = error = None
+    resp.raw.decode_content = True
+    try:
+        for prefix, event, value in ijson.parse(resp.raw, use_float=True):
+            # Помилка в тілі з кодом 200 (ліміт, токен) — як у _poster_body, інакше день виглядав би порожнім
+            if error is not None:
+                if prefix == "":
+                    break
+                error.event(event, value)
+            elif prefix == "" and event == "map_key" and value == "error":
+                error = ijson.ObjectBuilder()
+            elif prefix == "response.data.item":
+                if event == "start_map":
+                    trx = {"products": []}
+                elif event == "end_map":
+                    items.append(trx)
+                    trx = None
+            elif trx is not None:
+                if prefix == "response.data.item.products.item":
+                    if event == "start_map":
+                        line = {}
+                        trx["products"].append(line)
+                elif prefix in _TRX_FIELDS:
+                    trx[_TRX_FIELDS[prefix]] = value
+                elif prefix in _LINE_FIELDS:
+                    line[_LINE_FIELDS[prefix]] = value
+            elif prefix == "response.count":
+                count = int(value)
+            elif prefix == "response.page.per_page":
+                per_page = int(value or 0)
+    except Exception:
+        poster_checked(resp, failed=True)
+        raise
+    finally:
+        resp.close()
+    poster_checked(resp, failed=error is not None)
+    if error is not None:
+        raise UpstreamError(f"{urlsplit(resp.url).path}: {error.value}")
+    return items, count, per_page
+
+# Єдине місце, де обирається спосіб розбору сторінок транзакцій
+TRANSACTIONS_STREAMING = JSON_STREAMING and ijson is not None
+
+def fetch_minute_totals_for_date(venue, target_date_str):
+    compute = _minutes_for_date
+    if INCREMENTAL_TODAY and target_date_str == date.today().strftime("%Y-%m-%d"):
+        compute = _minutes_today
+    return closed_day_aggregate(venue, "minutes", target_date_str, compute)
+
+def fetch_transactions_hourly_for_date(venue, target_date_str, resolution=DEFAULT_RESOLUTION):
+    totals = fetch_minute_totals_for_date(venue, target_date_str)
+    return bucket_series(totals["hot"], totals["cold"], resolution)
+
+TRANSACTIONS_PER_PAGE = 500
+
+def _fetch_transactions(venue, target_date_str, first_page=1):
+    per_page = TRANSACTIONS_PER_PAGE
+
+    def page_url(page):
+        return (
+            f"{venue.poster_api}/transactions.getTransactions"
+            f"?token={venue.poster_token}&date_from={target_date_str}&date_to={target_date_str}"
             f"&per_page={per_page}&page={page}"
         )
+    parse_page = _stream_transactions_page if TRANSACTIONS_STREAMING else _transactions_page
+    return fetch_pages(
+        page_url, parse_page, per_page, first_page=first_page, stream=TRANSACTIONS_STREAMING
+    )
+
+def _minutes_for_date(venue, target_date_str):
+    load_products(venue)
+    if not venue.stations:
+        raise RuntimeError(f"{venue.slug}: product catalog is empty")
+
+    items, _ = _fetch_transactions(venue, target_date_str)
+    lines, _, _, unknown = pack_lines(items, venue.catalog)
+    if unknown:
+        # Товари, яких ще немає в довіднику, добираємо одразу й перераховуємо день
+        note_missing_products(venue, unknown)
         try:
-            resp = _get(url)
-            body = resp.json().get("response", {})
-            items = body.get("data", []) or []
-            total = int(body.get("count", 0))
-            page_info = body.get("page", {}) or {}
-            per_page_resp = int(page_info.get("per_page", per_page) or per_page)
+            refresh_products(venue)
         except Exception as e:
-            print(f"ERROR transactions for {target_date_str}:", e, file=sys.stderr, flush=True)
-            break
-
-        if not items:
-            break
+            log.warning("%s missing products: %s", venue.slug, e)
+        lines, _, _, unknown = pack_lines(items, venue.catalog)
+    payload = _totals_payload(*minute_totals(lines))
+    with venue.missing_lock:
+        unresolved = unknown - venue.unknown_products
+    if unresolved:
+        # Без частини позицій день не архівується: наступне оновлення порахує його повністю
+        log.warning("%s %s: %d products not in catalog yet", venue.slug, target_date_str, len(unresolved))
+        payload["partial"] = True
+    return payload
+
+# ===== Агрегація позицій чеків =====
+def pack_lines(items, catalog, watermark="", boundary=()):
+    # Позиції чеків складаються в колонки (хвилина закриття, цех, кількість);
+    # watermark — найпізніший date_close серед урахованих транзакцій,
+    # boundary — id транзакцій, закритих саме в цю секунду;
+    # unknown — id товарів, яких немає в довіднику; catalog — пара (довідник, покажчик) одного оновлення
+    products, stations = catalog
+    boundary = set(boundary)
+    minutes, codes, qtys = array("H"), array("B"), array("q")
+    known = len(stations)
+    unknown = set()
+    for trx in items:
+        dt_str = trx.get("date_close")
+        try:
+            minute = int(dt_str[11:13]) * 60 + int(dt_str[14:16])
+        except (TypeError, ValueError):
+            continue
+        if not 0 <= minute < MINUTES_PER_DAY:
+            continue
+        tid = trx.get("transaction_id")
+        if dt_str < watermark or (dt_str == watermark and tid in boundary):
+            continue
+        if dt_str > watermark:
+            watermark, boundary = dt_str, set()
+        boundary.add(tid)
 
-        for trx in items:
-            dt_str = trx.get("date_close")
+        for p in trx.get("products", []) or []:
             try:
-                dt = datetime.strptime(dt_str, "%Y-%m-%d %H:%M:%S")
-                hour = dt.hour
-                if hour not in hours:
-                    continue
-                idx = hours.index(hour)
+                pid = int(p.get("product_id", 0))
+                qty = int(float(p.get("num", 0)))
             except Exception:
                 continue
-
-            for p in trx.get("products", []) or []:
-                try:
-                    pid = int(p.get("product_id", 0))
-                    qty = int(float(p.get("num", 0)))
-                except Exception:
-                    continue
-                cid = products.get(pid, 0)
-                if cid in HOT_CATEGORIES:
-                    hot_by_hour[idx] += qty
-                elif cid in COLD_CATEGORIES:
-                    cold_by_hour[idx] += qty
-
-        if per_page_resp * page >= total:
-            break
-        page += 1
-
-    hot_cum, cold_cum = [], []
-    th, tc = 0, 0
-    for h, c in zip(hot_by_hour, cold_by_hour):
-        th += h
-        tc += c
-        hot_cum.append(th)
-        cold_cum.append(tc)
-
-    labels = [f"{h:02d}:00" for h in hours]
-    return {"labels": labels, "hot": hot_cum, "cold": cold_cum}
+            if pid <= 0:
+                continue
+            if pid not in products or pid >= known:
+                unknown.add(pid)
+                continue
+            station = stations[pid]
+            if station == STATION_OTHER:
+                continue
+            minutes.append(minute)
+            codes.append(station)
+            qtys.append(qty)
+    return (minutes, codes, qtys), watermark, boundary, unknown
+
+def _totals_payload(hot, cold):
+    if np is not None:
+        return {"hot": np.asarray(hot).tolist(), "cold": np.asarray(cold).tolist()}
+    return {"hot": list(hot), "cold": list(cold)}
+
+def zero_totals():
+    if np is not None:
+        return np.zeros(MINUTES_PER_DAY, dtype=np.int64)
+    return [0] * MINUTES_PER_DAY
+
+def add_totals(a, b):
+    if np is not None:
+        return a + b
+    return [x + y for x, y in zip(a, b)]
+
+def minute_totals(lines):
+    # Поминутні суми гарячого й холодного цехів за один прохід по колонках
+    minutes, codes, qtys = lines
+    if not minutes:
+        return zero_totals(), zero_totals()
+    if np is not None:
+        slots = STATION_BAR + 1
+        idx = np.frombuffer(minutes, dtype=np.uint16).astype(np.intp) * slots
+        idx += np.frombuffer(codes, dtype=np.uint8)
+        totals = np.bincount(
+            idx, weights=np.frombuffer(qtys, dtype=np.int64), minlength=MINUTES_PER_DAY * slots
+        )
+        totals = totals.round().astype(np.int64).reshape(MINUTES_PER_DAY, slots)
+        return totals[:, STATION_HOT].copy(), totals[:, STATION_COLD].copy()
+
+    hot, cold = [0] * MINUTES_PER_DAY, [0] * MINUTES_PER_DAY
+    for minute, station, qty in zip(minutes, codes, qtys):
+        if station == STATION_HOT:
+            hot[minute] += qty
+        elif station == STATION_COLD:
+            cold[minute] += qty
+    return hot, cold
+
+def bucket_series(hot, cold, width=DEFAULT_RESOLUTION, start=OPEN_MINUTE, end=CLOSE_MINUTE):
+    offsets = list(range(start, end, width))
+
+    def cumulative(totals):
+        if np is not None:
+            totals = np.asarray(totals)
+            sums = np.add.reduceat(totals[start:end], [o - start for o in offsets])
+            # Замовлення до відкриття і після закриття не губляться, а йдуть у крайні інтервали
+            sums[0] += totals[:start].sum()
+            sums[-1] += totals[end:].sum()
+            return sums.cumsum().tolist()
+        sums = [sum(totals[o:min(o + width, end)]) for o in offsets]
+        sums[0] += sum(totals[:start])
+        sums[-1] += sum(totals[end:])
+        return list(accumulate(sums))
+
+    labels = [f"{m // 60:02d}:{m % 60:02d}" for m in offsets]
+    return {"labels": labels, "hot": cumulative(hot), "cold": cumulative(cold)}
+
+# ===== Інкрементальний облік сьогоднішнього дня =====
+def _minutes_today(venue, target_date_str):
+    load_products(venue)
+    catalog = venue.catalog
+    if not catalog[1]:
+        raise RuntimeError(f"{venue.slug}: product catalog is empty")
+
+    with venue.today_lock:
+        state = venue.today
+        now = time.time()
+        full = state["day"] != target_date_str or now - state["reconciled"] >= FULL_RECONCILE_SEC
+        if full:
+            hot, cold = zero_totals(), zero_totals()
+            watermark, boundary, first_page = "", set(), 1
+        else:
+            # Poster не фільтрує getTransactions за часом закриття, тож пропускаємо
+            # вже прочитані сторінки за лічильником, а дублі відсікає watermark
+            hot, cold = state["hot"], state["cold"]
+            watermark, boundary = state["watermark"], state["boundary"]
+            first_page = state["count"] // TRANSACTIONS_PER_PAGE + 1
+
+        items, total = _fetch_transactions(venue, target_date_str, first_page=first_page)
+        lines, watermark, boundary, unknown = pack_lines(items, catalog, watermark, boundary)
+        if unknown:
+            note_missing_products(venue, unknown)
+        new_hot, new_cold = minute_totals(lines)
+        hot, cold = add_totals(hot, new_hot), add_totals(cold, new_cold)
+        state.update({
+            "day": target_date_str, "hot": hot, "cold": cold,
+            "count": total or 0,
+            "watermark": watermark, "boundary": boundary,
+            "reconciled": now if full else state["reconciled"],
+        })
+    return _totals_payload(hot, cold)
 
 # ===== Почасова діаграма =====
-def fetch_transactions_hourly(day_offset=0):
+def fetch_minute_totals(venue, day_offset=0):
     target_date = (date.today() - timedelta(days=day_offset)).strftime("%Y-%m-%d")
-    return fetch_transactions_hourly_for_date(target_date)
+    return fetch_minute_totals_for_date(venue, target_date)
+
+def series_by_resolution(totals):
+    return {res: bucket_series(totals["hot"], totals["cold"], res) for res in SERIES_RESOLUTIONS}
 
 # ===== Отримання даних рік назад по дню тижня =====
-def fetch_transactions_hourly_year_ago():
+def fetch_minute_totals_year_ago(venue):
+    return fetch_minute_totals_for_date(venue, year_ago_same_weekday())
+
+def year_ago_same_weekday():
     today = date.today()
     today_weekday = today.weekday()
     
     year_ago = today - timedelta(days=365)
     year_ago_weekday = year_ago.weekday()
     day_diff = today_weekday - year_ago_weekday
-    year_ago_same_weekday = year_ago + timedelta(days=day_diff)
+    same_weekday = year_ago + timedelta(days=day_diff)
     
-    target_date_str = year_ago_same_weekday.strftime("%Y-%m-%d")
-    print(f"DEBUG: Year ago same weekday: {target_date_str} ({year_ago_same_weekday.strftime('%A')})", file=sys.stderr, flush=True)
-    
-    return fetch_transactions_hourly_for_date(target_date_str)
+    target_date_str = same_weekday.strftime("%Y-%m-%d")
+    log.debug("year ago same weekday: %s (%s)", target_date_str, same_weekday.strftime("%A"))
+    return target_date_str
 
 # ===== Погода =====
-def fetch_weather():
+def fetch_weather(location=WEATHER_LOCATION):
     if not WEATHER_KEY:
         return {"temp": "Н/Д", "desc": "Н/Д", "icon": ""}
-    try:
-        url = f"https://api.openweathermap.org/data/2.5/weather?lat=50.395&lon=30.355&appid={WEATHER_KEY}&units=metric&lang=uk"
-        resp = requests.get(url, timeout=10)
-        data = resp.json()
-        temp = round(data["main"]["temp"])
-        desc = data["weather"][0]["description"].capitalize()
-        icon = data["weather"][0]["icon"]
-        return {"temp": f"{temp}°C", "desc": desc, "icon": icon}
-    except Exception as e:
-        print("ERROR weather:", e, file=sys.stderr, flush=True)
-        return {"temp": "Н/Д", "desc": "Н/Д", "icon": ""}
+    lat, lon = location
+    url = f"{WEATHER_BASE_URL}/data/2.5/weather?lat={lat}&lon={lon}&appid={WEATHER_KEY}&units=metric&lang=uk"
+    data = _get(url).json()
+    temp = round(data["main"]["temp"])
+    desc = data["weather"][0]["description"].capitalize()
+    icon = data["weather"][0]["icon"]
+    return {"temp": f"{temp}°C", "desc": desc, "icon": icon}
 
 # ===== Столи =====
-HALL_TABLES = [1,2,3,4,5,6,8]
-TERRACE_TABLES = [7,10,11,12,13]
-
-def fetch_tables_with_waiters():
+def fetch_tables_with_waiters(venue):
     target_date = date.today().strftime("%Y%m%d")
     url = (
-        f"https://{ACCOUNT_NAME}.joinposter.com/api/dash.getTransactions"
-        f"?token={POSTER_TOKEN}&dateFrom={target_date}&dateTo={target_date}"
+        f"{venue.poster_api}/dash.getTransactions"
+        f"?token={venue.poster_token}&dateFrom={target_date}&dateTo={target_date}"
     )
-    try:
-        resp = _get(url)
-        rows = resp.json().get("response", [])
-    except Exception as e:
-        print("ERROR tables_with_waiters:", e, file=sys.stderr, flush=True)
-        rows = []
+    # Без відповіді Poster усі столи виглядали б вільними — помилку віддаємо вище
+    rows = _poster_body(_get(url)).get("response", [])
 
     active = {}
     for trx in rows:
@@ -262,12 +1591,12 @@ def fetch_tables_with_waiters():
             })
         return out
 
-    return {"hall": build(HALL_TABLES), "terrace": build(TERRACE_TABLES)}
+    return {"hall": build(venue.hall_tables), "terrace": build(venue.terrace_tables)}
 
 # ===== Бронювання Choice =====
-def fetch_bookings():
-    if not CHOICE_TOKEN:
-        print("WARNING: CHOICE_TOKEN not set", file=sys.stderr, flush=True)
+def fetch_bookings(venue):
+    if not venue.choice_token:
+        log.warning("%s: CHOICE_TOKEN not set", venue.slug)
         return []
 
     today = date.today()
@@ -277,31 +1606,30 @@ def fetch_bookings():
     from_str = from_dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
     till_str = till_dt.strftime("%Y-%m-%dT%H:%M:%S.000Z")
     
-    url = f"https://open-api.choiceqr.com/bookings/list?from={from_str}&till={till_str}&perPage=100"
+    url = f"{CHOICE_BASE_URL}/bookings/list?from={from_str}&till={till_str}&perPage=100"
     
-    print(f"DEBUG: Fetching bookings from URL: {url}", file=sys.stderr, flush=True)
+    log.debug("fetching bookings from URL: %s", url)
     
     headers = {
-        "Authorization": f"Bearer {CHOICE_TOKEN}",
+        "Authorization": f"Bearer {venue.choice_token}",
         "Content-Type": "application/json"
     }
     
     try:
-        resp = requests.get(url, headers=headers, timeout=15)
+        resp = http_session(url).get(url, headers=headers, timeout=HTTP_TIMEOUTS)
         
-        print(f"DEBUG: Choice API status: {resp.status_code}", file=sys.stderr, flush=True)
-        print(f"DEBUG: Choice API response: {resp.text[:500]}", file=sys.stderr, flush=True)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Choice API -> %s : %s", resp.status_code, _body_snippet(resp))
         
         if resp.status_code == 404:
-            print("WARNING: Choice API returned 404 - check endpoint URL or restaurant ID", file=sys.stderr, flush=True)
+            log.warning("Choice API returned 404 - check endpoint URL or restaurant ID")
             return []
         
         resp.raise_for_status()
         bookings = resp.json()
         
         if not isinstance(bookings, list):
-            print(f"ERROR: Expected list, got {type(bookings)}", file=sys.stderr, flush=True)
-            return []
+            raise UpstreamError(f"bookings: expected list, got {type(bookings).__name__}")
         
         now = datetime.now()
         future_bookings = []
@@ -310,10 +1638,8 @@ def fetch_bookings():
             try:
                 # Фильтр по статусу - только активные брони
                 status = b.get("status", "")
-                print(f"DEBUG: Booking status: {status}, time: {b.get('dateTime', 'N/A')}", file=sys.stderr, flush=True)
-                
                 if status not in ["CREATED", "CONFIRMED", "IN_PROGRESS"]:
-                    print(f"DEBUG: Skipping booking with status: {status}", file=sys.stderr, flush=True)
+                    log.debug("skipping booking with status %s at %s", status, b.get("dateTime"))
                     continue
                 
                 dt_str = b.get("dateTime")
@@ -348,7 +1674,7 @@ def fetch_bookings():
                     "datetime_obj": booking_dt
                 })
             except Exception as e:
-                print(f"ERROR parsing booking: {e}", file=sys.stderr, flush=True)
+                log.error("parsing booking: %s", e)
                 continue
         
         future_bookings.sort(key=lambda x: x["datetime_obj"])
@@ -356,59 +1682,1040 @@ def fetch_bookings():
         for b in future_bookings:
             del b["datetime_obj"]
         
-        print(f"DEBUG: Found {len(future_bookings)} future bookings", file=sys.stderr, flush=True)
+        log.debug("found %d future bookings", len(future_bookings))
         return future_bookings
         
     except Exception as e:
-        print(f"ERROR fetching bookings: {e}", file=sys.stderr, flush=True)
-        return []
+        log.error("%s fetching bookings: %s", venue.slug, e)
+        raise
+
+# ===== Фонове оновлення =====
+# ===== Опубліковані знімки: SSE, ETag, дельти =====
+# channel -> {"version", "etags", "bodies", "payloads", "history", "encoded"};
+# bodies — готовий JSON для кожного варіанту відповіді (роздільності графіка)
+CHANNELS = {}
+CHANNELS_COND = threading.Condition()
+# Заклад (або група) -> кількість підключених SSE-екранів
+STREAM_CLIENTS = {}
+
+def _dumps(payload):
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True)
+
+def publish(channel, payloads):
+    bodies = {key: _dumps(payload) for key, payload in payloads.items()}
+    etags = {key: hashlib.sha1(body.encode("utf-8")).hexdigest()[:20] for key, body in bodies.items()}
+    with CHANNELS_COND:
+        current = CHANNELS.get(channel)
+        # Екрани отримують повідомлення лише тоді, коли вміст справді змінився
+        if current and current["etags"] == etags:
+            return False
+        history = {}
+        for key, payload in payloads.items():
+            versions = dict((current or {}).get("history", {}).get(key, {}))
+            versions[etags[key]] = payload
+            history[key] = dict(list(versions.items())[-DELTA_HISTORY:])
+        CHANNELS[channel] = {
+            "version": (current["version"] if current else 0) + 1,
+            "etags": etags,
+            "bodies": bodies,
+            "payloads": payloads,
+            "history": history,
+            "encoded": {},
+        }
+        CHANNELS_COND.notify_all()
+    return True
+
+def wait_for_changes(seen, timeout, prefix=""):
+    def changed():
+        return {
+            ch: state for ch, state in CHANNELS.items()
+            if ch.startswith(prefix) and state["version"] != seen.get(ch)
+        }
 
-# ===== API =====
-@app.route("/api/sales")
-def api_sales():
-    global CACHE, CACHE_TS
-    if time.time() - CACHE_TS > 60:
-        sums_today = fetch_category_sales(0)
-        sums_prev = fetch_category_sales(7)
-        hourly = fetch_transactions_hourly(0)
-        prev = fetch_transactions_hourly(7)
-        year = fetch_transactions_hourly_year_ago()
-
-        total_hot = sum(sums_today["hot"].values())
-        total_cold = sum(sums_today["cold"].values())
-        total_bar = sum(sums_today["bar"].values())
-        total_sum = total_hot + total_cold + total_bar
-        share = {
-            "hot": round(total_hot/total_sum*100) if total_sum else 0,
-            "cold": round(total_cold/total_sum*100) if total_sum else 0,
-            "bar": round(total_bar/total_sum*100) if total_sum else 0,
+    with CHANNELS_COND:
+        CHANNELS_COND.wait_for(changed, timeout)
+        updates = changed()
+    for ch, state in updates.items():
+        seen[ch] = state["version"]
+    return updates
+
+def _channel_payloads(kind, value):
+    # Продажі публікуються окремим тілом для кожної роздільності графіка
+    if kind == "sales":
+        return {str(res): payload for res, payload in value.items()}
+    return {"": value}
+
+def _share(sums):
+    total_hot = sum(sums["hot"].values())
+    total_cold = sum(sums["cold"].values())
+    total_bar = sum(sums["bar"].values())
+    total_sum = total_hot + total_cold + total_bar
+    return {
+        "hot": round(total_hot/total_sum*100) if total_sum else 0,
+        "cold": round(total_cold/total_sum*100) if total_sum else 0,
+        "bar": round(total_bar/total_sum*100) if total_sum else 0,
+    }
+
+def mark_degraded(channel, failed=(), recovered=()):
+    # Повертає True, якщо набір деградованих розділів каналу змінився
+    with _degraded_lock:
+        before = DEGRADED.get(channel, set())
+        after = (before - set(recovered)) | set(failed)
+        if after:
+            DEGRADED[channel] = after
+        else:
+            DEGRADED.pop(channel, None)
+    if after and after != before:
+        log.warning("%s: serving last good %s", channel, ", ".join(sorted(after)))
+    if after != before:
+        share_health()
+    return after != before
+
+# Який результат паралельного запиту наповнює які розділи знімка продажів
+SALES_SECTIONS = {
+    "sums_today": ("hot", "cold", "bar", "share"),
+    "sums_prev": ("hot_prev", "cold_prev"),
+    "hourly": ("hourly",),
+    "hourly_prev": ("hourly_prev",),
+    "hourly_year": ("hourly_year",),
+    "weather": ("weather",),
+}
+
+def _publish_sales(venue, sections, series=None, touch=True, degraded_changed=False):
+    if not sections and not series and not degraded_changed:
+        return
+    channel = venue.channel("sales")
+
+    # Знімок продажів — словник {роздільність: payload}, що підміняється цілком
+    def merge(current):
+        payloads = {}
+        for res in SERIES_RESOLUTIONS:
+            snapshot = dict(current.get(res) or current.get(DEFAULT_RESOLUTION) or EMPTY_SALES)
+            snapshot.update(sections)
+            for key, by_resolution in (series or {}).items():
+                snapshot[key] = by_resolution[res]
+            snapshot["degraded"] = sorted(DEGRADED.get(channel, ()))
+            payloads[res] = snapshot
+        if touch:
+            STALE.discard(channel)
+        publish(channel, _channel_payloads("sales", payloads))
+        return payloads
+
+    SALES.update(merge, touch=touch, key=venue.slug)
+
+def _apply_weather(venue, fut):
+    if fut.exception() is None:
+        changed = mark_degraded(venue.channel("sales"), recovered=SALES_SECTIONS["weather"])
+        _publish_sales(venue, {"weather": fut.result()}, touch=False, degraded_changed=changed)
+    else:
+        changed = mark_degraded(venue.channel("sales"), failed=SALES_SECTIONS["weather"])
+        _publish_sales(venue, {}, touch=False, degraded_changed=changed)
+
+def refresh_sales(venue):
+    futures = fan_out({
+        "sums_today": (fetch_category_sales, venue, 0),
+        "sums_prev": (fetch_category_sales, venue, 7),
+        "hourly": (fetch_minute_totals, venue, 0),
+        "hourly_prev": (fetch_minute_totals, venue, 7),
+        "hourly_year": (fetch_minute_totals_year_ago, venue),
+        "weather": (WEATHER.get, venue.location),
+    })
+    # Погода не затримує продажі: якщо ще не готова, допишеться в знімок пізніше
+    weather = futures.pop("weather")
+    results = gather(futures, SALES_REFRESH_DEADLINE)
+
+    sections, series = {}, {}
+    if "sums_today" in results:
+        sums_today = results["sums_today"]
+        sections.update(
+            hot=sums_today["hot"], cold=sums_today["cold"], bar=sums_today["bar"], share=_share(sums_today)
+        )
+    if "sums_prev" in results:
+        sums_prev = results["sums_prev"]
+        sections.update(hot_prev=sums_prev["hot"], cold_prev=sums_prev["cold"])
+    # Ряди всіх роздільностей рахуються з тих самих поминутних сум, без зайвих запитів
+    for key in ("hourly", "hourly_prev", "hourly_year"):
+        if key in results:
+            series[key] = series_by_resolution(results[key])
+    # Розділи, що не оновились (помилка чи дедлайн), лишаються з попереднього знімка й позначаються
+    failed = [section for name in futures.keys() - results.keys() for section in SALES_SECTIONS[name]]
+    recovered = [section for name in results for section in SALES_SECTIONS[name]]
+    if weather.done():
+        if weather.exception() is None:
+            sections["weather"] = weather.result()
+            recovered.extend(SALES_SECTIONS["weather"])
+        else:
+            failed.extend(SALES_SECTIONS["weather"])
+    else:
+        weather.add_done_callback(partial(_apply_weather, venue))
+
+    changed = mark_degraded(venue.channel("sales"), failed, recovered)
+    # Вік знімка скидає лише живе джерело: минулі дні читаються з архіву й вдаються і без Poster
+    touch = any(name in results for name in ("sums_today", "hourly"))
+    _publish_sales(venue, sections, series, touch=touch, degraded_changed=changed)
+
+# Кеші закладів мають ключ — slug закладу, погода — координати
+def _load_sales(slug):
+    return refresh_sales(VENUES[slug])
+
+def _load_bookings(slug):
+    venue = VENUES[slug]
+    try:
+        bookings = fetch_bookings(venue)
+    except Exception:
+        mark_degraded(venue.channel("bookings"), failed=("bookings",))
+        raise
+    mark_degraded(venue.channel("bookings"), recovered=("bookings",))
+    STALE.discard(venue.channel("bookings"))
+    publish(venue.channel("bookings"), {"": bookings})
+    return bookings
+
+def _load_tables(slug):
+    venue = VENUES[slug]
+    try:
+        tables = fetch_tables_with_waiters(venue)
+    except Exception:
+        mark_degraded(venue.channel("tables"), failed=("tables",))
+        raise
+    mark_degraded(venue.channel("tables"), recovered=("tables",))
+    STALE.discard(venue.channel("tables"))
+    publish(venue.channel("tables"), {"": tables})
+    return tables
+
+SALES = TTLCache("sales", _load_sales, SALES_TTL_SEC, default={})
+BOOKINGS = TTLCache("bookings", _load_bookings, BOOKINGS_TTL_SEC, default=[])
+TABLES = TTLCache("tables", _load_tables, TABLES_TTL_SEC)
+WEATHER = TTLCache("weather", fetch_weather, WEATHER_TTL_SEC)
+VENUE_CACHES = {"sales": SALES, "bookings": BOOKINGS, "tables": TABLES}
+
+def _refresh_tables_for_stream(venue):
+    # Столи без push-клієнтів оновлюються лише запитами /api/tables;
+    # у спільному режимі клієнти інших воркерів лідеру не видно, тож оновлюємо завжди
+    if STREAM_CLIENTS.get(venue.slug) or STREAM_CLIENTS.get(GROUP_SLUG) or SHARED_STORE:
+        TABLES.get(venue.slug)
+
+# ===== Група закладів =====
+# Зведений вигляд складається з уже закешованих знімків закладів, без окремих запитів до API
+def _sum_counts(dicts):
+    total = {}
+    for counts in dicts:
+        for name, qty in counts.items():
+            total[name] = total.get(name, 0) + qty
+    return dict(sorted(total.items()))
+
+def _sum_series(series):
+    series = [s for s in series if s.get("labels")]
+    if not series:
+        return {}
+    return {
+        "labels": series[0]["labels"],
+        "hot": [sum(values) for values in zip(*(s["hot"] for s in series))],
+        "cold": [sum(values) for values in zip(*(s["cold"] for s in series))],
+    }
+
+def _group_sales(entries):
+    payloads = {}
+    for res in SERIES_RESOLUTIONS:
+        venues = [sales.get(res) or sales.get(DEFAULT_RESOLUTION) or EMPTY_SALES for _, sales in entries]
+        snapshot = {
+            key: _sum_counts(p.get(key, {}) for p in venues)
+            for key in ("hot", "cold", "bar", "hot_prev", "cold_prev")
         }
+        for key in ("hourly", "hourly_prev", "hourly_year"):
+            snapshot[key] = _sum_series(p.get(key, {}) for p in venues)
+        snapshot["share"] = _share(snapshot)
+        snapshot["degraded"] = sorted({section for p in venues for section in p.get("degraded", ())})
+        if "weather" in venues[0]:
+            snapshot["weather"] = venues[0]["weather"]
+        payloads[res] = snapshot
+    return payloads
+
+def _group_bookings(entries):
+    bookings = [dict(b, venue=venue.title) for venue, venue_bookings in entries for b in venue_bookings]
+    return sorted(bookings, key=lambda b: b.get("time", ""))
+
+def _group_tables(entries):
+    return {
+        zone: [
+            dict(t, name=f"{venue.title} · {t['name']}")
+            for venue, tables in entries for t in (tables or {}).get(zone, [])
+        ]
+        for zone in ("hall", "terrace")
+    }
+
+GROUP_BUILDERS = {"sales": _group_sales, "bookings": _group_bookings, "tables": _group_tables}
+
+def _build_group(kind):
+    cache = VENUE_CACHES[kind]
+    entries = []
+    for venue in VENUES.values():
+        value, ts = cache.entry(venue.slug)
+        if ts:
+            entries.append((venue, value))
+    if not entries:
+        return None
+    value = GROUP_BUILDERS[kind](entries)
+    publish(f"{GROUP_SLUG}:{kind}", _channel_payloads(kind, value))
+    return value
+
+GROUP = TTLCache("group", _build_group, 0)
 
-        CACHE.update({
-            "hot": sums_today["hot"], "cold": sums_today["cold"],
-            "hot_prev": sums_prev["hot"], "cold_prev": sums_prev["cold"],
-            "hourly": hourly, "hourly_prev": prev, "hourly_year": year,
-            "share": share, "weather": fetch_weather()
+def _regroup(cache, key, value, ts):
+    # Перераховуємо під замком запису групи, тож одночасні зміни закладів не губляться
+    GROUP.update(lambda _: _build_group(cache.name), key=cache.name)
+
+# /group/ відкривається й з одним закладом, тож зведений знімок стежить за змінами завжди
+for _cache in VENUE_CACHES.values():
+    _cache.listeners.append(_regroup)
+
+JOBS = {}
+
+def register_job(name, fn, interval):
+    JOBS[name] = {"fn": fn, "interval": interval, "next_run": 0, "running": False}
+
+def _run_job(name, job):
+    started = time.time()
+    try:
+        job["fn"]()
+    except Exception as e:
+        log.exception("refresh %s failed: %s", name, e)
+    finally:
+        job["next_run"] = started + job["interval"]
+        job["running"] = False
+
+def _scheduler_loop():
+    while True:
+        now = time.time()
+        for name, job in JOBS.items():
+            if job["running"] or now < job["next_run"]:
+                continue
+            job["running"] = True
+            threading.Thread(
+                target=_run_job, args=(name, job), name=f"refresh-{name}", daemon=True
+            ).start()
+        time.sleep(1)
+
+_scheduler_started = False
+
+def start_scheduler():
+    global _scheduler_started
+    if _scheduler_started:
+        return
+    _scheduler_started = True
+    threading.Thread(target=_scheduler_loop, name="scheduler", daemon=True).start()
+
+# Заклади оновлюються паралельно: кожна задача планувальника працює у власному потоці
+for _venue in VENUES.values():
+    register_job(f"sales:{_venue.slug}", partial(SALES.refresh, _venue.slug), SALES_REFRESH_SEC)
+    register_job(f"bookings:{_venue.slug}", partial(BOOKINGS.refresh, _venue.slug), BOOKINGS_REFRESH_SEC)
+    register_job(f"products:{_venue.slug}", partial(refresh_products, _venue), PRODUCTS_DELTA_SEC)
+    register_job(f"tables:{_venue.slug}", partial(_refresh_tables_for_stream, _venue), TABLES_REFRESH_SEC)
+
+# ===== Знімок на диску =====
+def save_snapshot():
+    venues = {}
+    for slug in VENUES:
+        sales, sales_ts = SALES.entry(slug)
+        bookings, bookings_ts = BOOKINGS.entry(slug)
+        tables, tables_ts = TABLES.entry(slug)
+        if sales_ts or bookings_ts or tables_ts:
+            venues[slug] = {
+                "sales": {
+                    "data": sales.get(DEFAULT_RESOLUTION, EMPTY_SALES), "ts": sales_ts,
+                    "by_resolution": {str(res): payload for res, payload in sales.items()},
+                },
+                "bookings": {"data": bookings, "ts": bookings_ts},
+                "tables": {"data": tables, "ts": tables_ts},
+            }
+    if not venues:
+        return
+    snapshot = {"saved": time.time(), "venues": venues}
+    tmp = f"{SNAPSHOT_PATH}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+    os.replace(tmp, SNAPSHOT_PATH)
+
+def load_snapshot():
+    try:
+        with open(SNAPSHOT_PATH, encoding="utf-8") as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        log.error("snapshot load: %s", e)
+        return
+
+    # Знімок старого формату (без закладів) належить закладу за замовчуванням
+    venues = snapshot.get("venues") or {DEFAULT_VENUE.slug: snapshot}
+    for slug, saved in venues.items():
+        venue = VENUES.get(slug)
+        if venue is None:
+            continue
+        sales = saved.get("sales") or {}
+        if sales.get("ts"):
+            payloads = {
+                int(res): payload for res, payload in (sales.get("by_resolution") or {}).items()
+                if int(res) in SERIES_RESOLUTIONS
+            }
+            saved["sales"] = {"data": payloads or {DEFAULT_RESOLUTION: sales["data"]}, "ts": sales["ts"]}
+        for kind, cache in VENUE_CACHES.items():
+            entry = saved.get(kind) or {}
+            if entry.get("ts"):
+                cache.put(entry["data"], entry["ts"], key=slug)
+                STALE.add(venue.channel(kind))
+                publish(venue.channel(kind), _channel_payloads(kind, entry["data"]))
+    log.info("snapshot loaded: %s", ", ".join(sorted(STALE)) or "empty")
+
+def _save_snapshot_on_exit():
+    if SHARED_STORE and not is_leader():
+        return
+    try:
+        save_snapshot()
+    except Exception as e:
+        log.error("snapshot save on exit: %s", e)
+
+def _handle_sigterm(signum, frame):
+    # sys.exit запускає atexit, тож знімок збережеться і при зупинці Render
+    sys.exit(0)
+
+def _periodic_snapshot():
+    try:
+        save_snapshot()
+    except OSError as e:
+        log.error("snapshot save: %s", e)
+
+register_job("snapshot", _periodic_snapshot, SNAPSHOT_SEC)
+
+# ===== Спільний знімок для кількох воркерів =====
+VENUES_BY_ACCOUNT = {venue.account: venue for venue in VENUES.values()}
+_leader_file = None
+
+def _decode_shared(kind, value):
+    # JSON перетворює ключі-роздільності на рядки
+    if kind == "sales":
+        return {int(res): payload for res, payload in value.items()}
+    return value
+
+def shared_put(cache, key, value, ts):
+    try:
+        conn = _store_connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO shared (account, channel, ts, written, payload) VALUES (?, ?, ?, ?, ?)",
+                    (VENUES[key].account, cache.name, ts, time.time(), json.dumps(value, ensure_ascii=False)),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.error("shared put %s %s: %s", key, cache.name, e)
+
+def shared_get(venue, kind):
+    conn = _store_connect()
+    try:
+        row = conn.execute(
+            "SELECT ts, payload FROM shared WHERE account = ? AND channel = ?", (venue.account, kind)
+        ).fetchone()
+    finally:
+        conn.close()
+    return (row[0], _decode_shared(kind, json.loads(row[1]))) if row else None
+
+# Запобіжники й деградовані розділи лідера: послідовники не ходять в API і віддають його стан
+HEALTH_CHANNEL = "health"
+SHARED_BREAKERS = {}
+
+def share_health():
+    if not SHARED_STORE or not is_leader():
+        return
+    with _degraded_lock:
+        degraded = {channel: sorted(sections) for channel, sections in DEGRADED.items()}
+    value = {"degraded": degraded, "breakers": {host: b.status() for host, b in BREAKERS.items()}}
+    try:
+        conn = _store_connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO shared (account, channel, ts, written, payload) VALUES ('', ?, ?, ?, ?)",
+                    (HEALTH_CHANNEL, time.time(), time.time(), json.dumps(value, ensure_ascii=False)),
+                )
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.error("shared put health: %s", e)
+
+def _apply_health(value):
+    with _degraded_lock:
+        DEGRADED.clear()
+        DEGRADED.update({channel: set(sections) for channel, sections in value["degraded"].items()})
+    SHARED_BREAKERS.clear()
+    SHARED_BREAKERS.update(value["breakers"])
+
+def breaker_states():
+    if SHARED_STORE and not is_leader():
+        return dict(SHARED_BREAKERS)
+    return {host: breaker.status() for host, breaker in BREAKERS.items()}
+
+def _apply_shared(venue, kind, ts, value):
+    VENUE_CACHES[kind].put(value, ts, key=venue.slug)
+    STALE.discard(venue.channel(kind))
+    publish(venue.channel(kind), _channel_payloads(kind, value))
+
+def sync_shared(seen):
+    conn = _store_connect()
+    try:
+        rows = conn.execute("SELECT account, channel, written FROM shared").fetchall()
+    finally:
+        conn.close()
+    for account, kind, written in rows:
+        if not account and kind == HEALTH_CHANNEL:
+            if seen.get(("", kind)) != written:
+                conn = _store_connect()
+                try:
+                    row = conn.execute(
+                        "SELECT payload FROM shared WHERE account = '' AND channel = ?", (HEALTH_CHANNEL,)
+                    ).fetchone()
+                finally:
+                    conn.close()
+                if row:
+                    _apply_health(json.loads(row[0]))
+                seen[("", kind)] = written
+            continue
+        venue = VENUES_BY_ACCOUNT.get(account)
+        if venue is None or kind not in VENUE_CACHES or seen.get((account, kind)) == written:
+            continue
+        row = shared_get(venue, kind)
+        if row:
+            _apply_shared(venue, kind, *row)
+        seen[(account, kind)] = written
+
+def _follower_loader(kind):
+    # Воркер-послідовник не ходить в API: «оновлення» — це перечитати спільне сховище
+    def load(slug):
+        venue = VENUES[slug]
+        row = shared_get(venue, kind)
+        if row:
+            _apply_shared(venue, kind, *row)
+    return load
+
+def is_leader():
+    return _leader_file is not None or fcntl is None
+
+def try_lead():
+    global _leader_file
+    if is_leader():
+        return True
+    f = open(LEADER_LOCK, "a")
+    try:
+        # Замок тримається, доки живий процес; після його смерті лідером стане інший воркер
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return False
+    _leader_file = f
+    return True
+
+_loaders = {kind: cache.loader for kind, cache in VENUE_CACHES.items()}
+
+def _become_leader():
+    for kind, cache in VENUE_CACHES.items():
+        cache.loader = _loaders[kind]
+        cache.listeners.append(shared_put)
+    # Запобіжники попереднього лідера не переносяться: новий починає з власних
+    SHARED_BREAKERS.clear()
+    share_health()
+    log.info("shared store: pid %d is the leader", os.getpid())
+    if SCHEDULER_ENABLED:
+        start_scheduler()
+
+def _follow_shared():
+    seen = {}
+    while not try_lead():
+        try:
+            sync_shared(seen)
+        except sqlite3.Error as e:
+            log.error("shared sync: %s", e)
+        time.sleep(SHARED_POLL_SEC)
+    _become_leader()
+
+def start_shared():
+    if try_lead():
+        _become_leader()
+        return
+    for kind, cache in VENUE_CACHES.items():
+        cache.loader = _follower_loader(kind)
+    log.info("shared store: pid %d follows the leader", os.getpid())
+    threading.Thread(target=_follow_shared, name="shared-sync", daemon=True).start()
+
+# ===== Історія продажів =====
+# Закриті дні, що вже лежать в AGGREGATE_DB; запити до API тут не робляться
+HISTORY_GROUPS = ("day", "week", "month")
+HISTORY_MAX_DAYS = 3 * 366
+STATIONS = ("hot", "cold", "bar")
+
+def _period_of(day, group):
+    if group == "week":
+        year, week, _ = day.isocalendar()
+        return day - timedelta(days=day.weekday()), f"{year}-W{week:02d}"
+    if group == "month":
+        return day.replace(day=1), day.strftime("%Y-%m")
+    return day, day.isoformat()
+
+def _days(day_from, day_to):
+    return [day_from + timedelta(days=i) for i in range((day_to - day_from).days + 1)]
+
+def sales_history(venues, day_from, day_to, group="day"):
+    periods, covered = {}, {}
+    for venue in venues:
+        for day_str, sums in store_range(venue.account, "categories", day_from.isoformat(), day_to.isoformat()):
+            covered[day_str] = covered.get(day_str, 0) + 1
+            start, label = _period_of(date.fromisoformat(day_str), group)
+            period = periods.setdefault(start, {"label": label, "days": set(), **{s: {} for s in STATIONS}})
+            period["days"].add(day_str)
+            for station in STATIONS:
+                counts = period[station]
+                for name, qty in sums.get(station, {}).items():
+                    counts[name] = counts.get(name, 0) + qty
+
+    out = []
+    for start in sorted(periods):
+        period = periods[start]
+        out.append({
+            "period": period["label"],
+            "start": start.isoformat(),
+            "days": len(period["days"]),
+            "totals": {station: sum(period[station].values()) for station in STATIONS},
+            "share": _share(period),
+            "categories": {station: dict(sorted(period[station].items())) for station in STATIONS},
         })
-        CACHE_TS = time.time()
+    # День вважається відсутнім, якщо його немає хоча б в одного закладу
+    missing = [d.isoformat() for d in _days(day_from, day_to) if covered.get(d.isoformat(), 0) < len(venues)]
+    return {"from": day_from.isoformat(), "to": day_to.isoformat(), "group": group, "periods": out, "missing": missing}
+
+# ===== Backfill =====
+def backfill(venue, day_from, day_to, workers=4, rate=5.0, budget=None):
+    # Сьогоднішній день ще не закритий і в архів не потрапляє
+    day_to = min(day_to, date.today() - timedelta(days=1))
+    todo = []
+    for day in _days(day_from, day_to):
+        if store_get(venue.account, "categories", day.isoformat()) is None:
+            todo.append(day.isoformat())
+    skipped = max(0, len(todo) - budget) if budget is not None else 0
+    if skipped:
+        todo = todo[:budget]
+
+    # Запити рівномірно розподіляються в часі, щоб не перевищити rate на секунду
+    interval = 1.0 / rate if rate else 0
+    pace_lock = threading.Lock()
+    next_slot = [time.monotonic()]
+
+    def pace():
+        with pace_lock:
+            now = time.monotonic()
+            slot = max(now, next_slot[0])
+            next_slot[0] = slot + interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def load(day):
+        pace()
+        with request_priority(PRIORITY_BACKFILL):
+            closed_day_aggregate(venue, "categories", day, _category_sales_for_date)
+
+    done, failed = 0, []
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="backfill") as pool:
+        futures = {pool.submit(load, day): day for day in todo}
+        for fut in futures:
+            day = futures[fut]
+            try:
+                fut.result()
+                done += 1
+            except Exception as e:
+                failed.append(day)
+                log.error("%s backfill %s: %s", venue.slug, day, e)
+    log.info(
+        "%s backfill: %d stored, %d failed, %d left over budget", venue.slug, done, len(failed), skipped
+    )
+    return {"stored": done, "failed": failed, "over_budget": skipped}
+
+def backfill_main(argv):
+    parser = argparse.ArgumentParser(prog="app.py backfill", description="Архів продажів за закриті дні")
+    parser.add_argument("--from", dest="day_from", required=True, type=date.fromisoformat)
+    parser.add_argument("--to", dest="day_to", type=date.fromisoformat,
+                        default=date.today() - timedelta(days=1))
+    parser.add_argument("--venue", action="append", choices=list(VENUES),
+                        help="заклад (можна кілька разів); за замовчуванням усі")
+    parser.add_argument("--workers", type=int, default=4, help="паралельних запитів")
+    parser.add_argument("--rate", type=float, default=5.0, help="запитів на секунду на заклад")
+    parser.add_argument("--budget", type=int, help="максимум запитів до API на заклад")
+    args = parser.parse_args(argv)
+    if args.day_from > args.day_to:
+        parser.error("--from must not be after --to")
+
+    venues = [VENUES[slug] for slug in args.venue] if args.venue else list(VENUES.values())
+    failed = 0
+    with ThreadPoolExecutor(max_workers=len(venues), thread_name_prefix="venue") as pool:
+        results = pool.map(
+            lambda v: backfill(v, args.day_from, args.day_to, args.workers, args.rate, args.budget), venues
+        )
+        for venue, result in zip(venues, results):
+            print(f"{venue.slug}: stored {result['stored']}, failed {len(result['failed'])},"
+                  f" over budget {result['over_budget']}")
+            failed += len(result["failed"])
+    return 1 if failed else 0
+
+# ===== API =====
+def _delta_body(state, key, since):
+    # Лише розділи, що змінились відносно версії клієнта; невідома версія — повний знімок
+    etag = state["etags"][key]
+    payload = state["payloads"][key]
+    base = state["history"].get(key, {}).get(since)
+    if not isinstance(payload, dict) or not isinstance(base, dict):
+        return _dumps({"version": etag, "full": True, "data": payload})
+    changed = {name: value for name, value in payload.items() if base.get(name) != value}
+    removed = [name for name in base if name not in payload]
+    return _dumps({"version": etag, "base": since, "changed": changed, "removed": removed})
+
+def _encode(body, accept):
+    if brotli is not None and "br" in accept:
+        return "br", brotli.compress(body, quality=5)
+    if "gzip" in accept:
+        return "gzip", gzip.compress(body, compresslevel=6)
+    return None, body
+
+def _channel_response(channel, key, payload, ts, stale=False, degraded=()):
+    state = CHANNELS.get(channel)
+    if state is None or key not in state["bodies"]:
+        resp = jsonify(payload)
+    else:
+        etag = state["etags"][key]
+        since = request.args.get("since")
+        if etag in request.if_none_match or since == etag:
+            resp = Response(status=304)
+        else:
+            if since and since not in state["history"].get(key, {}):
+                since = "?"
+            variant = (key, since)
+            accept = request.headers.get("Accept-Encoding", "")
+            encoded = state["encoded"].get((variant, accept))
+            if encoded is None:
+                body = _delta_body(state, key, since) if since else state["bodies"][key]
+                body = body.encode("utf-8")
+                encoding = None
+                if len(body) >= COMPRESS_MIN_BYTES:
+                    encoding, body = _encode(body, accept)
+                # Стиснуте тіло рахується один раз на версію знімка
+                encoded = state["encoded"][(variant, accept)] = (encoding, body)
+            encoding, body = encoded
+            resp = Response(body, mimetype="application/json")
+            if encoding:
+                resp.headers["Content-Encoding"] = encoding
+        resp.set_etag(etag)
+        resp.headers["Vary"] = "Accept-Encoding"
+        resp.headers["Cache-Control"] = "no-cache"
+    if ts:
+        resp.headers["Age"] = str(int(time.time() - ts))
+    if stale:
+        resp.headers.add("Warning", '110 - "Response is Stale"')
+    if degraded:
+        # Оновлення не вдалося — віддано останні вдалі дані
+        resp.headers.add("Warning", '111 - "Revalidation Failed"')
+        resp.headers["X-Degraded"] = ",".join(sorted(degraded))
+    return resp
+
+@app.before_request
+def _start_timer():
+    request.environ["dashboard.started"] = time.perf_counter()
+
+@app.after_request
+def _observe_request(resp):
+    started = request.environ.get("dashboard.started")
+    endpoint = request.endpoint or "unmatched"
+    if started is not None:
+        HTTP_SECONDS.observe(time.perf_counter() - started, endpoint, str(resp.status_code))
+    # Потік SSE не має довжини — його розмір не рахуємо
+    if not resp.is_streamed:
+        HTTP_BYTES.observe(resp.calculate_content_length() or 0, endpoint)
+    return resp
+
+def _resolve_venue(slug):
+    # Без префікса — заклад за замовчуванням, "group" — зведений вигляд усіх закладів
+    if slug is None:
+        return DEFAULT_VENUE
+    if slug == GROUP_SLUG:
+        return GROUP_SLUG
+    return VENUES.get(slug)
+
+def _unknown_venue(slug):
+    return jsonify({"error": f"unknown venue: {slug}"}), 404
+
+def _degraded(venues, kind):
+    return {section for venue in venues for section in DEGRADED.get(venue.channel(kind), ())}
+
+def _is_stale(venue, kind):
+    return venue.channel(kind) in STALE or not VENUE_CACHES[kind].fresh(venue.slug)
+
+def _cached(venue, kind):
+    # Застарілий знімок віддаємо одразу й оновлюємо у фоні; чекаємо лише коли даних ще немає
+    cache = VENUE_CACHES[kind]
+    if cache.entry(venue.slug)[1]:
+        if _is_stale(venue, kind):
+            CACHE_REQUESTS.inc(cache.name, "stale")
+            cache.refresh_in_background(venue.slug)
+        else:
+            CACHE_REQUESTS.inc(cache.name, "hit")
+        return cache.entry(venue.slug)
+    CACHE_REQUESTS.inc(cache.name, "miss")
+    try:
+        cache.refresh(venue.slug)
+    except Exception as e:
+        log.error("%s %s: %s", venue.slug, kind, e)
+    return cache.entry(venue.slug)
+
+def _group_cached(kind):
+    # Група лише підтягує застарілі заклади; вік — за найстарішим із них
+    cache = VENUE_CACHES[kind]
+    for venue in VENUES.values():
+        if not cache.entry(venue.slug)[1]:
+            try:
+                cache.refresh(venue.slug)
+            except Exception as e:
+                log.error("%s %s: %s", venue.slug, kind, e)
+        elif _is_stale(venue, kind):
+            cache.refresh_in_background(venue.slug)
+    value = GROUP.entry(kind)[0]
+    if value is None:
+        value = GROUP.refresh(kind)
+    ts = min((cache.entry(slug)[1] for slug in VENUES), default=0)
+    stale = any(_is_stale(venue, kind) for venue in VENUES.values())
+    return value, ts, stale
+
+def _parse_resolution(value):
+    # "15m", "15" або "1h"; без параметра — роздільність за замовчуванням
+    if not value:
+        return DEFAULT_RESOLUTION
+    value = value.strip().lower()
+    try:
+        if value.endswith("h"):
+            return int(value[:-1]) * 60
+        return int(value[:-1] if value.endswith("m") else value)
+    except ValueError:
+        return None
 
-    return jsonify(CACHE)
+@app.route("/api/sales")
+@app.route("/<venue>/api/sales")
+def api_sales(venue=None):
+    target = _resolve_venue(venue)
+    if target is None:
+        return _unknown_venue(venue)
+    resolution = _parse_resolution(request.args.get("resolution"))
+    if resolution not in SERIES_RESOLUTIONS:
+        allowed = ", ".join(f"{res}m" for res in SERIES_RESOLUTIONS)
+        return jsonify({"error": f"resolution must be one of: {allowed}"}), 400
+    if target == GROUP_SLUG:
+        channel = f"{GROUP_SLUG}:sales"
+        payloads, ts, stale = _group_cached("sales")
+    else:
+        channel = target.channel("sales")
+        payloads, ts = _cached(target, "sales")
+        stale = _is_stale(target, "sales")
+    payloads = payloads or {}
+    payload = payloads.get(resolution) or payloads.get(DEFAULT_RESOLUTION) or EMPTY_SALES
+    return _channel_response(channel, str(resolution), payload, ts, stale, payload.get("degraded"))
 
 @app.route("/api/tables")
-def api_tables():
-    return jsonify(fetch_tables_with_waiters())
+@app.route("/<venue>/api/tables")
+def api_tables(venue=None):
+    target = _resolve_venue(venue)
+    if target is None:
+        return _unknown_venue(venue)
+    if target == GROUP_SLUG:
+        tables, ts, stale = _group_cached("tables")
+        return _channel_response(
+            f"{GROUP_SLUG}:tables", "", tables or {"hall": [], "terrace": []}, ts, stale,
+            _degraded(VENUES.values(), "tables")
+        )
+    # Як продажі й броні: застарілі столи (і столи зі знімка після старту) віддаються одразу,
+    # dash.getTransactions чекаємо лише коли столів ще немає зовсім
+    tables, ts = _cached(target, "tables")
+    if tables is None:
+        return jsonify({"error": "tables are unavailable"}), 503
+    channel = target.channel("tables")
+    return _channel_response(channel, "", tables, ts, _is_stale(target, "tables"), DEGRADED.get(channel))
 
 @app.route("/api/bookings")
-def api_bookings():
-    global BOOKINGS_CACHE, BOOKINGS_CACHE_TS
-    if time.time() - BOOKINGS_CACHE_TS > 600:
-        BOOKINGS_CACHE = fetch_bookings()
-        BOOKINGS_CACHE_TS = time.time()
-    return jsonify(BOOKINGS_CACHE)
+@app.route("/<venue>/api/bookings")
+def api_bookings(venue=None):
+    target = _resolve_venue(venue)
+    if target is None:
+        return _unknown_venue(venue)
+    if target == GROUP_SLUG:
+        bookings, ts, stale = _group_cached("bookings")
+        return _channel_response(
+            f"{GROUP_SLUG}:bookings", "", bookings or [], ts, stale, _degraded(VENUES.values(), "bookings")
+        )
+    bookings, ts = _cached(target, "bookings")
+    return _channel_response(
+        target.channel("bookings"), "", bookings, ts, _is_stale(target, "bookings"),
+        DEGRADED.get(target.channel("bookings"))
+    )
+
+@app.route("/api/history")
+@app.route("/<venue>/api/history")
+def api_history(venue=None):
+    target = _resolve_venue(venue)
+    if target is None:
+        return _unknown_venue(venue)
+    group = request.args.get("group", "day")
+    if group not in HISTORY_GROUPS:
+        return jsonify({"error": f"group must be one of: {', '.join(HISTORY_GROUPS)}"}), 400
+    try:
+        day_to = date.fromisoformat(request.args["to"]) if request.args.get("to") else date.today() - timedelta(days=1)
+        day_from = date.fromisoformat(request.args["from"]) if request.args.get("from") else day_to - timedelta(days=29)
+    except ValueError:
+        return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+    if day_from > day_to or (day_to - day_from).days >= HISTORY_MAX_DAYS:
+        return jsonify({"error": f"range must be 1..{HISTORY_MAX_DAYS} days"}), 400
+    venues = list(VENUES.values()) if target == GROUP_SLUG else [target]
+    return jsonify(sales_history(venues, day_from, day_to, group))
+
+def shared_rate_hosts():
+    try:
+        conn = _store_connect()
+        try:
+            return [host for (host,) in conn.execute("SELECT host FROM rate_buckets").fetchall()]
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        log.warning("shared rate hosts: %s", e)
+        return []
+
+@app.route("/api/limits")
+def api_limits():
+    # Використання лімітів по хостах API за поточну й попередню хвилину. Зі спільними лімітами звіт
+    # будується з AGGREGATE_DB для всіх хостів, тож і послідовник, що сам не ходить в API, бачить усе
+    buckets = dict(LIMITERS)
+    if RATE_SHARED:
+        for host in shared_rate_hosts():
+            if host not in buckets:
+                buckets[host] = TokenBucket(host)
+    return jsonify({host: bucket.usage() for host, bucket in sorted(buckets.items())})
+
+@app.route("/api/health")
+def api_health():
+    # Стан запобіжників по хостах API і розділи, що зараз віддаються з останніх вдалих даних
+    # Послідовник віддає стан лідера зі спільного сховища
+    degraded = {channel: sorted(sections) for channel, sections in sorted(DEGRADED.items())}
+    breakers = breaker_states()
+    # Вік і TTL кожного закешованого значення: вік не скидається, поки API недоступний
+    caches = {
+        cache.name: {str(key): cache.meta(key) for key in sorted(cache._entries, key=str)}
+        for cache in (SALES, BOOKINGS, TABLES, WEATHER, GROUP)
+    }
+    return jsonify({
+        "ok": not degraded and all(b["state"] == "closed" for b in breakers.values()),
+        "breakers": dict(sorted(breakers.items())),
+        "degraded": degraded,
+        "caches": caches,
+    })
+
+def _gauges():
+    # Стан, що читається під час запиту /metrics: вік кешів, запобіжники, черги лімітів
+    lines = [
+        "# HELP dashboard_leader 1 if this worker fetches from the APIs (leader), 0 for a follower",
+        "# TYPE dashboard_leader gauge",
+        gauge_sample("dashboard_leader", {}, int(not SHARED_STORE or is_leader())),
+        "# HELP dashboard_cache_age_seconds Age of the cached value",
+        "# TYPE dashboard_cache_age_seconds gauge",
+    ]
+    for cache in (SALES, BOOKINGS, TABLES, WEATHER, GROUP):
+        for key, (_, ts) in sorted(cache._entries.items(), key=lambda item: str(item[0])):
+            if ts:
+                lines.append(gauge_sample(
+                    "dashboard_cache_age_seconds", {"cache": cache.name, "key": key}, round(time.time() - ts, 3)
+                ))
+    lines += [
+        "# HELP dashboard_breaker_open Circuit breaker state per host (0 closed, 1 open, 0.5 half-open)",
+        "# TYPE dashboard_breaker_open gauge",
+    ]
+    for host, status in sorted(breaker_states().items()):
+        state = {"closed": 0, "half-open": 0.5, "open": 1}[status["state"]]
+        lines.append(gauge_sample("dashboard_breaker_open", {"host": host}, state))
+    lines += [
+        "# HELP dashboard_rate_waiting Requests waiting for a rate-limit token",
+        "# TYPE dashboard_rate_waiting gauge",
+    ]
+    for host, bucket in sorted(LIMITERS.items()):
+        for priority, name in enumerate(PRIORITY_NAMES):
+            lines.append(gauge_sample(
+                "dashboard_rate_waiting", {"host": host, "priority": name}, bucket.waiting[priority]
+            ))
+    lines += [
+        "# HELP dashboard_degraded_sections Sections served from the last good data",
+        "# TYPE dashboard_degraded_sections gauge",
+    ]
+    for channel, sections in sorted(DEGRADED.items()):
+        lines.append(gauge_sample("dashboard_degraded_sections", {"channel": channel}, len(sections)))
+    return lines
+
+@app.route("/metrics")
+def metrics():
+    lines = [line for m in METRICS for line in m.render()] + _gauges()
+    return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/stream")
+@app.route("/<venue>/api/stream")
+def api_stream(venue=None):
+    target = _resolve_venue(venue)
+    if target is None:
+        return _unknown_venue(venue)
+    resolution = _parse_resolution(request.args.get("resolution"))
+    if resolution not in SERIES_RESOLUTIONS:
+        return jsonify({"error": "unsupported resolution"}), 400
+    slug = GROUP_SLUG if target == GROUP_SLUG else target.slug
+    prefix = f"{slug}:"
+    body_key = {"sales": str(resolution)}
+
+    # Місце займається під час запиту, а не в генераторі: інакше паралельні запити проскочать ліміт
+    with CHANNELS_COND:
+        if sum(STREAM_CLIENTS.values()) >= STREAM_MAX_CLIENTS:
+            resp = jsonify({"error": "too many streams, poll /api/sales instead"})
+            resp.headers["Retry-After"] = str(STREAM_HEARTBEAT_SEC)
+            return resp, 503
+        STREAM_CLIENTS[slug] = STREAM_CLIENTS.get(slug, 0) + 1
+
+    def release():
+        with CHANNELS_COND:
+            STREAM_CLIENTS[slug] -= 1
+
+    def events():
+        seen = {}
+        # Перше повідомлення — поточний стан усіх каналів закладу, далі лише зміни
+        while True:
+            updates = wait_for_changes(seen, STREAM_HEARTBEAT_SEC, prefix)
+            if not updates:
+                yield "event: ping\ndata: {}\n\n"
+                continue
+            for channel, state in updates.items():
+                kind = channel[len(prefix):]
+                body = state["bodies"].get(body_key.get(kind, ""))
+                if body is not None:
+                    yield f"event: {kind}\ndata: {body}\n\n"
+
+    resp = Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    # Сервер закриває відповідь і тоді, коли генератор так і не запустився
+    resp.call_on_close(release)
+    return resp
 
 # ===== UI =====
 @app.route("/")
-def index():
+@app.route("/<venue>/")
+def index(venue=None):
+    if _resolve_venue(venue) is None:
+        return _unknown_venue(venue)
     template = """
     <!DOCTYPE html>
     <html lang="uk">
@@ -546,6 +2853,13 @@ def index():
                 line-height: 0.9;
             }
 
+            /* Частина даних зі старого знімка: API зараз недоступний */
+            body.degraded .clock::after {
+                content: " ⚠";
+                font-size: 32px;
+                color: #ff9f0a;
+            }
+
             .weather {
                 display: flex;
                 flex-direction: column;
@@ -842,10 +3156,17 @@ def index():
         <script>
         let chart, pie;
 
+        const base = {{ base|tojson }};
+        const resolution = new URLSearchParams(location.search).get('resolution');
+        const salesUrl = base + '/api/sales' + (resolution ? '?resolution=' + encodeURIComponent(resolution) : '');
+
         function cutToNow(labels, arr){
             const now = new Date();
-            const curHour = now.getHours();
-            let cutIndex = labels.findIndex(l => parseInt(l) > curHour);
+            const curMinute = now.getHours() * 60 + now.getMinutes();
+            let cutIndex = labels.findIndex(l => {
+                const [h, m] = l.split(':').map(Number);
+                return h * 60 + m > curMinute;
+            });
             if(cutIndex === -1) cutIndex = labels.length;
             return arr.slice(0, cutIndex);
         }
@@ -899,9 +3220,7 @@ def index():
             });
         }
 
-        async function refresh(){
-            const r = await fetch('/api/sales');
-            const data = await r.json();
+        function renderSales(data){
 
             function fill(id, today, prev){
                 const el = document.getElementById(id);
@@ -1083,7 +3402,10 @@ def index():
             });
 
             const now = new Date();
-            document.getElementById('clock').innerText = now.toLocaleTimeString('uk-UA',{hour:'2-digit',minute:'2-digit'});
+            document.body.classList.toggle('degraded', (data.degraded||[]).length > 0);
+            const clockEl = document.getElementById('clock');
+            clockEl.title = (data.degraded||[]).length ? 'Не оновлено: ' + data.degraded.join(', ') : '';
+            clockEl.innerText = now.toLocaleTimeString('uk-UA',{hour:'2-digit',minute:'2-digit'});
             
             const w = data.weather||{};
             const iconEl = document.getElementById('weather-icon');
@@ -1100,31 +3422,108 @@ def index():
             descEl.textContent = w.desc || '—';
         }
 
-        async function refreshTables(){
-            const r = await fetch('/api/tables');
-            const data = await r.json();
+        function renderAllTables(data){
             renderTables('hall', data.hall||[]);
             renderTables('terrace', data.terrace||[]);
         }
 
+        // Після першої повної відповіді просимо лише розділи, що змінились з нашої версії
+        let salesVersion = null, salesData = null;
+        async function refresh(){
+            const url = salesVersion
+                ? salesUrl + (salesUrl.includes('?') ? '&' : '?') + 'since=' + encodeURIComponent(salesVersion)
+                : salesUrl;
+            const r = await fetch(url);
+            if(r.status === 304) return;
+            const body = await r.json();
+            if(!salesVersion){
+                salesData = body;
+            } else if(body.full){
+                salesData = body.data;
+            } else {
+                salesData = Object.assign({}, salesData, body.changed);
+                (body.removed || []).forEach(k => delete salesData[k]);
+            }
+            salesVersion = body.version || (r.headers.get('ETag') || '').replace(/"/g, '');
+            renderSales(salesData);
+        }
+
+        async function refreshTables(){
+            const r = await fetch(base + '/api/tables');
+            renderAllTables(await r.json());
+        }
+
         async function refreshBookings(){
-            const r = await fetch('/api/bookings');
-            const bookings = await r.json();
-            renderBookings(bookings);
+            const r = await fetch(base + '/api/bookings');
+            renderBookings(await r.json());
+        }
+
+        function startPolling(){
+            refresh();
+            refreshTables();
+            refreshBookings();
+
+            setInterval(refresh, 60000);
+            setInterval(refreshTables, 30000);
+            setInterval(refreshBookings, 600000);
         }
 
-        refresh(); 
-        refreshTables();
-        refreshBookings();
+        // Сервер сам надсилає зміни; якщо потік відхилено або він мовчить довше за три heartbeat-и — опитуємо як раніше
+        function startStream(){
+            const es = new EventSource(base + '/api/stream' + (resolution ? '?resolution=' + encodeURIComponent(resolution) : ''));
+            let lastEvent = Date.now();
+            let polling = false;
+            const seen = () => { lastEvent = Date.now(); };
+            es.addEventListener('ping', seen);
+            es.addEventListener('sales', e => { seen(); renderSales(JSON.parse(e.data)); });
+            es.addEventListener('tables', e => { seen(); renderAllTables(JSON.parse(e.data)); });
+            es.addEventListener('bookings', e => { seen(); renderBookings(JSON.parse(e.data)); });
+            const fallback = () => {
+                if(polling) return;
+                polling = true;
+                es.close();
+                startPolling();
+            };
+            // Сервер без вільних потоків відповідає 503 — EventSource закривається, переходимо на опитування одразу
+            es.onerror = () => { if(es.readyState === EventSource.CLOSED) fallback(); };
+            setInterval(() => {
+                if(Date.now() - lastEvent > 3 * {{ heartbeat }} * 1000) fallback();
+            }, 10000);
+        }
 
-        setInterval(refresh, 60000);
-        setInterval(refreshTables, 30000);
-        setInterval(refreshBookings, 600000);
+        if(window.EventSource){
+            startStream();
+        } else {
+            startPolling();
+        }
         </script>
     </body>
     </html>
     """
-    return render_template_string(template)
+    base = f"/{venue}" if venue else ""
+    return render_template_string(template, heartbeat=STREAM_HEARTBEAT_SEC, base=base)
+
+for _venue in VENUES.values():
+    _load_persisted_catalog(_venue)
+
+# Команда backfill працює без сервера, знімків і планувальника
+if __name__ == "__main__" and sys.argv[1:2] == ["backfill"]:
+    sys.exit(backfill_main(sys.argv[2:]))
+
+load_snapshot()
+atexit.register(_save_snapshot_on_exit)
+try:
+    # Свій обробник ставимо, лише якщо SIGTERM ще нічий (gunicorn керує воркерами сам)
+    if signal.getsignal(signal.SIGTERM) in (signal.SIG_DFL, None):
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+except ValueError:
+    # Імпорт не з головного потоку — обробник сигналу поставити не можна
+    pass
+
+if SHARED_STORE:
+    start_shared()
+elif SCHEDULER_ENABLED:
+    start_scheduler()
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 5000))
@@ -0,0 +1,236 @@
+import os
+import sys
+import json
+import time
+import random
+import threading
+import argparse
+import tempfile
+import tracemalloc
+from statistics import median
+from datetime import date, timedelta
+from urllib.parse import urlsplit, parse_qsl
+
+# ===== Бенчмарк оновлень на відтворених відповідях API =====
+# Запуск: python bench.py [--dataset small typical saturday] [--repeat 5] [--latency 0.05]
+# Синтетичні набори генеруються детерміновано; --fixtures DIR відтворює записані UPSTREAM_MODE=record
+
+DATASETS = {
+    # товарів у довіднику, чеків за день, позицій у чеку
+    "small": {"products": 300, "checks": 120, "lines": (1, 3)},
+    "typical": {"products": 1200, "checks": 700, "lines": (1, 5)},
+    "saturday": {"products": 1500, "checks": 2600, "lines": (2, 7)},
+}
+PAGED_METHODS = {"menu.getProducts", "transactions.getTransactions"}
+
+def _setup_env(args, workdir):
+    # Конфігурація app.py читається під час імпорту, тож оточення готуємо до нього
+    os.environ.update(
+        UPSTREAM_MODE="replay",
+        REPLAY_LATENCY_SEC=str(args.latency),
+        SCHEDULER_ENABLED="0",
+        SHARED_STORE="0",
+        AGGREGATE_DB=os.path.join(workdir, "aggregates.db"),
+        SNAPSHOT_PATH=os.path.join(workdir, "snapshot.json"),
+        VENUES_CONFIG=os.path.join(workdir, "venues.json"),
+        POSTER_RATE="0", CHOICE_RATE="0", WEATHER_RATE="0",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    os.environ.setdefault("POSTER_TOKEN", "bench")
+    os.environ.setdefault("CHOICE_TOKEN", "bench")
+    os.environ.setdefault("WEATHER_KEY", "bench")
+    if args.fixtures:
+        os.environ["FIXTURES_DIR"] = args.fixtures
+
+# ===== Синтетичні відповіді Poster, Choice та погоди =====
+class SyntheticUpstream:
+    def __init__(self, profile, seed=1):
+        self.profile = profile
+        self.seed = seed
+        rng = random.Random(seed)
+        categories = [4, 13, 15, 7, 8, 11, 16, 9, 14, 27, 28, 100]
+        self.products = [
+            {"product_id": str(pid), "menu_category_id": str(rng.choice(categories))}
+            for pid in range(1, profile["products"] + 1)
+        ]
+        self._days = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def transactions(self, day):
+        # Чеки дня рахуються один раз і однакові між повторами
+        if day not in self._days:
+            rng = random.Random(f"{self.seed}:{day}")
+            low, high = self.profile["lines"]
+            checks = []
+            for i in range(self.profile["checks"]):
+                minute = rng.randint(10 * 60, 23 * 60 - 1)
+                checks.append({
+                    "transaction_id": str(i + 1),
+                    "date_close": f"{day} {minute // 60:02d}:{minute % 60:02d}:{rng.randint(0, 59):02d}",
+                    "products": [
+                        {"product_id": str(rng.randint(1, len(self.products))), "num": str(rng.randint(1, 3))}
+                        for _ in range(rng.randint(low, high))
+                    ],
+                })
+            checks.sort(key=lambda t: t["date_close"])
+            # Паралельні сторінки можуть згенерувати той самий день двічі — результат однаковий
+            self._days.setdefault(day, checks)
+        return self._days[day]
+
+    def respond(self, url):
+        parts = urlsplit(url)
+        query = dict(parse_qsl(parts.query))
+        method = parts.path.rstrip("/").rsplit("/", 1)[-1]
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        body = self._body(method, query)
+        if body is None:
+            return None
+        return {"status": 200, "content_type": "application/json", "body": json.dumps(body, ensure_ascii=False)}
+
+    def _body(self, method, query):
+        if method == "menu.getProducts":
+            per_page, page = int(query.get("per_page", 500)), int(query.get("page", 1))
+            items = self.products if query.get("type") == "products" else []
+            return {"response": items[(page - 1) * per_page: page * per_page]}
+        if method == "menu.getProduct":
+            return {"response": {"product_id": query.get("product_id"), "menu_category_id": "4"}}
+        if method == "transactions.getTransactions":
+            day = query["date_from"]
+            day = day if "-" in day else f"{day[:4]}-{day[4:6]}-{day[6:]}"
+            checks = self.transactions(day)
+            per_page, page = int(query.get("per_page", 500)), int(query.get("page", 1))
+            return {"response": {
+                "count": len(checks), "page": {"per_page": per_page, "page": page},
+                "data": checks[(page - 1) * per_page: page * per_page],
+            }}
+        if method == "dash.getCategoriesSales":
+            rng = random.Random(f"{self.seed}:{query.get('dateFrom')}")
+            return {"response": [
+                {"category_id": str(cid), "category_name": f"Категорія {cid}", "count": str(rng.randint(1, 80))}
+                for cid in (4, 13, 15, 7, 8, 11, 9, 14, 27)
+            ]}
+        if method == "dash.getTransactions":
+            return {"response": [{"status": "1", "table_name": str(t), "name": "Офіціант"} for t in (1, 3, 7, 10)]}
+        if method == "list":
+            return [
+                {"status": "CONFIRMED", "dateTime": f"{date.today()}T{18 + i % 4}:00:00+03:00",
+                 "personCount": 2 + i % 5, "customer": {"name": f"Гість {i}"}}
+                for i in range(20)
+            ]
+        if method == "weather":
+            return {"main": {"temp": 18.4}, "weather": [{"description": "хмарно", "icon": "03d"}]}
+        return None
+
+# ===== Сценарії =====
+def _reset(app, venue):
+    # Кожен повтор починається з холодного стану: без довідника, архіву днів і кешів
+    venue.catalog, venue.products_ts = ({}, bytearray()), 0
+    venue.today["day"] = None
+    for cache in (app.SALES, app.TABLES, app.BOOKINGS, app.WEATHER):
+        cache._entries = {}
+    app.STALE.clear()
+    with app._store_connect() as conn:
+        conn.execute("DELETE FROM aggregates")
+
+def bench_transactions(app, venue, day):
+    app.load_products(venue)
+    return lambda: app.fetch_transactions_hourly_for_date(venue, day)
+
+def bench_products(app, venue, day):
+    return lambda: app.load_products(venue)
+
+def bench_api_sales(app, venue, day):
+    client = app.app.test_client()
+
+    def run():
+        resp = client.get("/api/sales")
+        assert resp.status_code == 200, resp.status_code
+    return run
+
+SCENARIOS = {
+    "fetch_transactions_hourly_for_date": bench_transactions,
+    "load_products": bench_products,
+    "api_sales": bench_api_sales,
+}
+
+def _measure(app, venue, source, scenario, day, repeat):
+    times, pages, calls = [], 0, 0
+    for _ in range(repeat):
+        _reset(app, venue)
+        run = SCENARIOS[scenario](app, venue, day)
+        source.calls.clear()
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+        calls = sum(source.calls.values())
+        pages = sum(n for method, n in source.calls.items() if method in PAGED_METHODS)
+
+    # Пам'ять міряємо окремим прогоном: tracemalloc сповільнює виконання
+    _reset(app, venue)
+    run = SCENARIOS[scenario](app, venue, day)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "wall_ms": round(median(times) * 1000, 1),
+        "wall_ms_max": round(max(times) * 1000, 1),
+        "pages": pages,
+        "calls": calls,
+        "peak_mib": round(peak / 2**20, 2),
+    }
+
+class _Counting:
+    # Лічильник викликів для відтворення записаних фікстур
+    def __init__(self, load):
+        self.load = load
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def respond(self, url):
+        method = urlsplit(url).path.rstrip("/").rsplit("/", 1)[-1]
+        with self.lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        return self.load(url)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark refreshes against replayed upstream responses")
+    parser.add_argument("--dataset", nargs="+", choices=sorted(DATASETS), default=["small", "typical", "saturday"])
+    parser.add_argument("--scenario", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="injected latency per upstream call, seconds")
+    parser.add_argument("--fixtures", help="replay recorded fixtures from this directory instead of synthetic data")
+    parser.add_argument("--date", help="closed day to benchmark, YYYY-MM-DD (default: yesterday)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="dashboard-bench-")
+    _setup_env(args, workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app
+
+    venue = app.DEFAULT_VENUE
+    day = args.date or str(date.today() - timedelta(days=1))
+    datasets = ["recorded"] if args.fixtures else args.dataset
+    results = []
+    for name in datasets:
+        source = _Counting(app.FIXTURES.load) if args.fixtures else SyntheticUpstream(DATASETS[name])
+        app.REPLAY_SOURCE = source.respond
+        for scenario in args.scenario:
+            row = {"dataset": name, "scenario": scenario}
+            row.update(_measure(app, venue, source, scenario, day, args.repeat))
+            results.append(row)
+            if not args.json:
+                print(
+                    f"{name:<9} {scenario:<36} {row['wall_ms']:>9.1f} ms (max {row['wall_ms_max']:.1f})"
+                    f" {row['pages']:>4} pages {row['calls']:>4} calls {row['peak_mib']:>8.2f} MiB peak",
+                    flush=True,
+                )
+    if args.json:
+        print(json.dumps(results, indent=2))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
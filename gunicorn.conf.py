@@ -0,0 +1,12 @@
+import os
+
+# Воркери ділять один знімок в AGGREGATE_DB: в API ходить лише лідер
+os.environ.setdefault("SHARED_STORE", "1")
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+# Потоки потрібні для довгих SSE-з'єднань /api/stream
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", 16))
+timeout = 60
+graceful_timeout = 10
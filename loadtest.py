@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import heapq
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from bench import DATASETS, SyntheticUpstream
+
+# ===== Навантажувальний тест: парк екранів проти локальних заглушок API =====
+# Запуск: python loadtest.py --clients 30 --duration 120 --speedup 10
+# Дашборд стартує окремим процесом (gunicorn або app.py) і ходить у заглушки Poster, Choice та погоди
+
+# Розклад опитування зі сторінки: продажі, столи, броні (секунди)
+POLLS = {"sales": 60, "tables": 30, "bookings": 600}
+
+# ===== Заглушки API =====
+class _StandInHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency * random.uniform(0.5, 1.5))
+        fixture = server.upstream.respond(f"http://{self.headers.get('Host')}{self.path}")
+        status = fixture["status"] if fixture else 404
+        body = fixture["body"].encode("utf-8") if fixture else b"{}"
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stand_in(upstream, latency):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandInHandler)
+    server.daemon_threads = True
+    server.upstream = upstream
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, name="stand-in", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+# ===== Дашборд під навантаженням =====
+def start_dashboard(args, upstreams, workdir):
+    env = dict(
+        os.environ,
+        PORT=str(args.port),
+        POSTER_BASE_URL=upstreams["poster"] + "/{account}",
+        CHOICE_BASE_URL=upstreams["choice"],
+        WEATHER_BASE_URL=upstreams["weather"],
+        POSTER_TOKEN="loadtest", CHOICE_TOKEN="loadtest", WEATHER_KEY="loadtest",
+        AGGREGATE_DB=os.path.join(workdir, "aggregates.db"),
+        SNAPSHOT_PATH=os.path.join(workdir, "snapshot.json"),
+        VENUES_CONFIG=os.path.join(workdir, "venues.json"),
+        UPSTREAM_MODE="live",
+        LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
+    )
+    here = os.path.dirname(os.path.abspath(__file__))
+    if args.server == "gunicorn":
+        env["WEB_CONCURRENCY"] = str(args.workers)
+        cmd = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    else:
+        cmd = [sys.executable, "app.py"]
+    proc = subprocess.Popen(cmd, cwd=here, env=env)
+    base = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"dashboard exited with code {proc.returncode}")
+        try:
+            requests.get(f"{base}/api/health", timeout=1)
+            return proc, base
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("dashboard did not start in 30s")
+
+# ===== Екрани =====
+class Screen:
+    def __init__(self, base):
+        self.base = base
+        self.sales_version = None
+
+    def url(self, kind):
+        # Як і сторінка: після першої відповіді продажі просимо дельтою від своєї версії
+        if kind == "sales" and self.sales_version:
+            return f"{self.base}/api/sales?since={self.sales_version}"
+        return f"{self.base}/api/{kind}"
+
+    def seen(self, kind, resp):
+        if kind == "sales" and resp.status_code == 200:
+            self.sales_version = resp.json().get("version") or resp.headers.get("ETag", "").strip('"') or None
+
+class Results:
+    def __init__(self):
+        self.latencies = {kind: [] for kind in POLLS}
+        self.errors = {kind: 0 for kind in POLLS}
+        self.lock = threading.Lock()
+
+    def add(self, kind, seconds, ok):
+        with self.lock:
+            self.latencies[kind].append(seconds)
+            if not ok:
+                self.errors[kind] += 1
+
+_local = threading.local()
+
+def _session():
+    # Окреме keep-alive з'єднання на потік, як у браузера на екрані
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
+def poll(screen, kind, results, timeout):
+    started = time.perf_counter()
+    try:
+        resp = _session().get(screen.url(kind), timeout=timeout)
+        ok = resp.status_code in (200, 304)
+        if ok:
+            screen.seen(kind, resp)
+    except requests.RequestException:
+        ok = False
+    results.add(kind, time.perf_counter() - started, ok)
+
+# ===== Екрани з потоком /api/stream =====
+class StreamResults:
+    def __init__(self, requested):
+        self.requested = requested
+        self.connected = 0
+        self.failed = 0
+        self.dropped = 0
+        self.events = {}
+        self.first_event = []
+        self.streams = []
+        self.lock = threading.Lock()
+
+def hold_stream(base, results, stop, start_at, timeout):
+    # Як EventSource на сторінці: одне довге з'єднання, що займає потік воркера до кінця тесту
+    delay = start_at - time.monotonic()
+    if delay > 0 and stop.wait(delay):
+        return
+    started = time.perf_counter()
+    try:
+        resp = requests.get(f"{base}/api/stream", stream=True, timeout=timeout)
+    except requests.RequestException:
+        with results.lock:
+            results.failed += 1
+        return
+    if resp.status_code != 200:
+        resp.close()
+        with results.lock:
+            results.failed += 1
+        return
+    with results.lock:
+        results.connected += 1
+        results.streams.append(resp)
+    first = True
+    try:
+        for line in resp.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("event: "):
+                continue
+            kind = line[len("event: "):]
+            with results.lock:
+                results.events[kind] = results.events.get(kind, 0) + 1
+                if first and kind != "ping":
+                    results.first_event.append(time.perf_counter() - started)
+                    first = False
+            if stop.is_set():
+                break
+    except (requests.RequestException, AttributeError, ValueError):
+        # Після зупинки з'єднання закриває головний потік — це не обрив
+        pass
+    if not stop.is_set():
+        with results.lock:
+            results.dropped += 1
+
+def start_streams(args, base, results, stop):
+    rng = random.Random(f"{args.seed}:sse")
+    now = time.monotonic()
+    threads = []
+    for i in range(args.sse):
+        # Читання чекає між подіями до heartbeat, тож тайм-аут читання має бути більшим за нього
+        thread = threading.Thread(
+            target=hold_stream, name=f"sse-{i}", daemon=True,
+            args=(base, results, stop, now + rng.uniform(0, args.ramp), (args.timeout, args.timeout + 60)),
+        )
+        thread.start()
+        threads.append(thread)
+    return threads
+
+def stop_streams(results, stop, threads):
+    stop.set()
+    with results.lock:
+        streams = list(results.streams)
+    for resp in streams:
+        resp.close()
+    for thread in threads:
+        thread.join(timeout=5)
+
+def run_clients(args, base, results):
+    # Один планувальник на всі екрани: купа (час, екран, розділ) і пул, що виконує запити
+    rng = random.Random(args.seed)
+    now = time.monotonic()
+    end = now + args.duration
+    queue = []
+    for i in range(args.clients):
+        screen = Screen(base)
+        # Екрани вмикаються не одночасно: старт розподілено на --ramp секунд
+        start = now + rng.uniform(0, args.ramp)
+        for kind in POLLS:
+            heapq.heappush(queue, (start, i, kind, screen))
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="screen") as pool:
+        while queue:
+            at, i, kind, screen = heapq.heappop(queue)
+            if at >= end:
+                break
+            delay = at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(poll, screen, kind, results, args.timeout)
+            heapq.heappush(queue, (at + POLLS[kind] / args.speedup, i, kind, screen))
+
+# ===== Звіт =====
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+def report(results, upstream_calls, elapsed, streams=None):
+    rows = {}
+    for kind, values in list(results.latencies.items()) + [("total", sum(results.latencies.values(), []))]:
+        errors = sum(results.errors.values()) if kind == "total" else results.errors[kind]
+        rows[kind] = {
+            "requests": len(values),
+            "errors": errors,
+            "error_rate": round(errors / len(values), 4) if values else 0,
+            **{f"p{p}_ms": round(percentile(values, p) * 1000, 1) if values else None for p in (50, 95, 99)},
+        }
+    total = rows["total"]["requests"]
+    summary = {
+        "elapsed_sec": round(elapsed, 1),
+        "rps": round(total / elapsed, 1) if elapsed else 0,
+        "endpoints": rows,
+        "upstream_calls": upstream_calls,
+        "amplification": round(sum(upstream_calls.values()) / total, 3) if total else None,
+    }
+    if streams is not None and streams.requested:
+        first = streams.first_event
+        summary["sse"] = {
+            "streams": streams.requested,
+            "connected": streams.connected,
+            "failed": streams.failed,
+            "dropped": streams.dropped,
+            "events": dict(sorted(streams.events.items())),
+            **{f"first_event_p{p}_ms": round(percentile(first, p) * 1000, 1) if first else None for p in (50, 95)},
+        }
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a fleet of dashboard screens against local API stand-ins")
+    parser.add_argument("--clients", type=int, default=20, help="number of simulated screens")
+    parser.add_argument("--duration", type=float, default=120, help="test length, seconds")
+    parser.add_argument("--speedup", type=float, default=1, help="divide polling intervals by this factor")
+    parser.add_argument("--ramp", type=float, default=10, help="spread screen start-up over this many seconds")
+    parser.add_argument("--sse", type=int, default=0, help="screens holding /api/stream open alongside the pollers")
+    parser.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--dataset", choices=sorted(DATASETS), default="typical")
+    parser.add_argument("--upstream-latency", type=float, default=0.15, help="mean stand-in response time, seconds")
+    parser.add_argument("--server", choices=("gunicorn", "flask"), default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args(argv)
+
+    upstream = SyntheticUpstream(DATASETS[args.dataset], seed=args.seed)
+    upstreams = {name: start_stand_in(upstream, args.upstream_latency) for name in ("poster", "choice", "weather")}
+    workdir = tempfile.mkdtemp(prefix="dashboard-loadtest-")
+    proc, base = start_dashboard(args, upstreams, workdir)
+    try:
+        # Прогрів: перше відкриття сторінки й стартові оновлення не входять у результати
+        for kind in POLLS:
+            requests.get(f"{base}/api/{kind}", timeout=args.timeout)
+        time.sleep(1)
+        with upstream.lock:
+            baseline = dict(upstream.calls)
+        results = Results()
+        streams, stop = StreamResults(args.sse), threading.Event()
+        started = time.monotonic()
+        threads = start_streams(args, base, streams, stop)
+        try:
+            run_clients(args, base, results)
+        finally:
+            elapsed = time.monotonic() - started
+            stop_streams(streams, stop, threads)
+        with upstream.lock:
+            calls = {m: n - baseline.get(m, 0) for m, n in upstream.calls.items() if n - baseline.get(m, 0)}
+    finally:
+        proc.terminate()
+        proc.wait(timeout=15)
+
+    summary = report(results, calls, elapsed, streams)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+    print(f"{args.clients} screens, {summary['elapsed_sec']}s, {summary['rps']} req/s (speedup x{args.speedup:g})")
+    for kind, row in summary["endpoints"].items():
+        print(
+            f"  {kind:<9} {row['requests']:>6} req  p50 {row['p50_ms']} ms  p95 {row['p95_ms']} ms"
+            f"  p99 {row['p99_ms']} ms  errors {row['errors']} ({row['error_rate']:.2%})"
+        )
+    if "sse" in summary:
+        sse = summary["sse"]
+        events = ", ".join(f"{kind} {n}" for kind, n in sse["events"].items()) or "none"
+        print(
+            f"  sse       {sse['connected']}/{sse['streams']} connected  failed {sse['failed']}"
+            f"  dropped {sse['dropped']}  first event p50 {sse['first_event_p50_ms']} ms"
+            f"  p95 {sse['first_event_p95_ms']} ms  events: {events}"
+        )
+    print(f"  upstream {sum(calls.values())} calls, {summary['amplification']} per client request")
+    for method, n in sorted(calls.items()):
+        print(f"    {method:<32} {n}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())